@@ -0,0 +1,73 @@
+# backend/activity.py - прореженное обновление User.last_active
+# Чтение профиля не пишет в БД: новое время активности запоминается в памяти,
+# только если сохраненное старше LAST_ACTIVE_GRANULARITY секунд, и раз в
+# ACTIVITY_FLUSH_INTERVAL секунд записывается пакетом (executemany).
+# Прямые записи last_active (создание пользователя, баланс) не перезаписываются
+# более старым значением из буфера.
+from datetime import datetime, timedelta
+from sqlalchemy import update, bindparam, or_
+from typing import Dict, Optional
+import logging
+import os
+import threading
+
+from backend.buffered import PeriodicFlusher
+from backend.db import engine, write_guard
+from backend.models import User
+
+logger = logging.getLogger(__name__)
+
+LAST_ACTIVE_GRANULARITY = int(os.getenv('LAST_ACTIVE_GRANULARITY', '300'))
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '30'))
+
+_users = User.__table__
+_touch = (
+    update(_users)
+    .where(
+        _users.c.id == bindparam("user_id"),
+        or_(_users.c.last_active.is_(None), _users.c.last_active < bindparam("seen_at")),
+    )
+    .values(last_active=bindparam("seen_at"))
+)
+
+
+class ActivityTracker(PeriodicFlusher):
+    name = "Активность пользователей"
+
+    def __init__(self, granularity: int = LAST_ACTIVE_GRANULARITY, interval: float = ACTIVITY_FLUSH_INTERVAL):
+        super().__init__(interval)
+        self.granularity = timedelta(seconds=granularity)
+        self._pending: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, user_id: int, stored: Optional[datetime]) -> datetime:
+        """Отмечает активность; возвращает актуальное значение last_active"""
+        now = datetime.utcnow()
+        with self._lock:
+            known = self._pending.get(user_id, stored)
+            if known is not None and now - known < self.granularity:
+                return known
+            self._pending[user_id] = now
+            return now
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            with write_guard(), engine.begin() as conn:
+                conn.execute(_touch, [
+                    {"user_id": user_id, "seen_at": seen_at} for user_id, seen_at in batch.items()
+                ])
+        except Exception as e:
+            # возвращаем в буфер, не затирая более свежие отметки
+            with self._lock:
+                for user_id, seen_at in batch.items():
+                    self._pending.setdefault(user_id, seen_at)
+            logger.warning(f"Не удалось записать last_active: {e}")
+            return 0
+        return len(batch)
+
+
+activity_tracker = ActivityTracker()
@@ -3,7 +3,15 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
 from dotenv import load_dotenv
-from backend.db import create_db_and_tables
+from backend.db import create_db_and_tables, dispose_engines, engine
+from backend.migrations import run_migrations
+from backend.search import check_index_ready
+from backend.view_counter import view_counter
+from backend.activity import activity_tracker
+from backend.receipt_images import receipt_images
+from backend.routes.captcha import captcha_pool, prebuild_glyphs
+from backend.reaper import reaper
+from backend.rate_limit import RateLimitMiddleware, RATE_LIMIT_ENABLED
 import logging
 
 load_dotenv()
@@ -33,6 +41,10 @@ else:
 
 logger.info("CORS origins: %s", cors_origins)
 
+# Лимит запросов добавляется до CORS: CORS остается внешним и проставляет заголовки и ответам 429
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
@@ -64,18 +76,42 @@ except Exception as e:
 def on_startup():
     try:
         create_db_and_tables()
+        run_migrations()
+        with engine.connect() as conn:
+            logger.info("Поиск: индекс %s", "включен" if check_index_ready(conn) else "недоступен, используется ilike")
         logger.info("DB: База данных инициализирована")
     except Exception as e:
         logger.exception("Ошибка инициализации БД: %s", e)
 
 
+@app.on_event("startup")
+async def start_background_tasks():
+    view_counter.start()
+    activity_tracker.start()
+    receipt_images.start()
+    prebuild_glyphs()  # для капч, отрисованных в этом процессе (пул пуст или выключен)
+    captcha_pool.start()
+    reaper.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await view_counter.stop()
+    await activity_tracker.stop()
+    await receipt_images.stop()
+    await captcha_pool.stop()
+    await reaper.stop()
+    await dispose_engines()
+
+
 @app.get("/health")
 def health():
     """Проверка работоспособности API"""
     return {
         "status": "ok",
         "service": "VoidShop API",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "reaped_rows": reaper.stats()
     }
 
 
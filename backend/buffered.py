@@ -0,0 +1,41 @@
+# backend/buffered.py - фоновая периодическая запись накопленных в памяти данных
+# Наследник копит изменения в памяти и реализует flush(); задача раз в interval
+# секунд вызывает flush() в пуле потоков, при остановке — последний раз.
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicFlusher:
+    name = "buffer"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task = None
+
+    def flush(self) -> int:
+        """Записывает накопленное, возвращает число записанных элементов"""
+        raise NotImplementedError
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            await loop.run_in_executor(None, self.flush)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        flushed = await asyncio.get_running_loop().run_in_executor(None, self.flush)
+        if flushed:
+            logger.info(f"{self.name}: записано при остановке: {flushed}")
@@ -0,0 +1,394 @@
+# backend/cache.py - кеш ответов каталога и настроек с инвалидацией при записи
+# Ключ — имя маршрута + параметры запроса. Каждая запись помечена таблицами,
+# от которых зависит ответ; после коммита, изменившего Store / Product / Category
+# (или SystemSettings), записи с этими метками удаляются. Просмотры товара (views)
+# кеш не сбрасывают — их устаревание ограничено TTL.
+#
+# Бэкенд выбирается через CACHE_BACKEND:
+#   memory — LRU в памяти процесса (по умолчанию, один воркер uvicorn)
+#   sqlite — общий файл CACHE_SQLITE_PATH для всех воркеров на одной машине
+#   redis  — общий Redis-совместимый сервер CACHE_REDIS_URL (нужен пакет redis)
+# В общих бэкендах инвалидация удаляет записи в общем хранилище, поэтому ее
+# сразу видят все воркеры. Бэкенд memory сбрасывается только в процессе,
+# сделавшем запись; от чужих записей защищают версии таблиц (TableVersion):
+# каталог кладет их в ключ записи, настройки сверяют версию
+# (см. backend/versions.py и backend/settings.py).
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Hashable, Iterable, Optional
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from backend.models import Store, Product, Category, SystemSettings
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory').strip().lower()
+CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH', './voidshop_cache.db')
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', '1024'))
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '60'))
+SETTINGS_CACHE_TTL = float(os.getenv('SETTINGS_CACHE_TTL', '300'))
+RECEIPT_CACHE_SIZE = int(os.getenv('RECEIPT_CACHE_SIZE', '2048'))
+RECEIPT_CACHE_TTL = float(os.getenv('RECEIPT_CACHE_TTL', '3600'))
+
+_MISSING = object()
+
+
+class CacheBackend:
+    """Общий интерфейс кеша: get / set / invalidate по меткам / stats
+
+    Счетчики попаданий считаются в каждом процессе отдельно.
+    """
+
+    kind = "base"
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._get(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str] = ()) -> None:
+        if self.maxsize > 0:
+            self._set(key, value, frozenset(tags))
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        """Удаляет записи, помеченные хотя бы одной из меток"""
+        tags = set(tags)
+        if not tags:
+            return 0
+        removed = self._invalidate(tags)
+        self.invalidations += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": self.kind,
+            "size": self._size(),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value, tags):
+        raise NotImplementedError
+
+    def _invalidate(self, tags) -> int:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def _size(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Потокобезопасный LRU с TTL в памяти процесса"""
+
+    kind = "memory"
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float):
+        super().__init__(namespace, maxsize, ttl)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return _MISSING
+            if entry[0] <= now:
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def _set(self, key, value, tags):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, tags, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _invalidate(self, tags) -> int:
+        with self._lock:
+            stale = [key for key, (_, entry_tags, _) in self._entries.items() if entry_tags & tags]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _size(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Общий кеш в отдельном файле SQLite (WAL) для воркеров на одной машине
+
+    Значения хранятся в pickle. Вместо строгого LRU при переполнении удаляются
+    записи с самым ранним сроком истечения — так чтение не требует записи.
+    """
+
+    kind = "sqlite"
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float, path: str):
+        super().__init__(namespace, maxsize, ttl)
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, expires REAL NOT NULL, value BLOB NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_tags ("
+                "namespace TEXT NOT NULL, tag TEXT NOT NULL, key TEXT NOT NULL, "
+                "PRIMARY KEY (namespace, tag, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_expires ON cache_entries (namespace, expires)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM cache_entries WHERE namespace = ? AND key = ? AND expires > ?",
+            (self.namespace, repr(key), time.time()),
+        ).fetchone()
+        return pickle.loads(row[0]) if row else _MISSING
+
+    def _set(self, key, value, tags):
+        conn = self._connection()
+        key = repr(key)
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, expires, value) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, now + self.ttl, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO cache_tags (namespace, tag, key) VALUES (?, ?, ?)",
+                [(self.namespace, tag, key) for tag in tags],
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires <= ?", (self.namespace, now))
+        (size,) = conn.execute("SELECT count(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)).fetchone()
+        overflow = size - self.maxsize
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY expires LIMIT ?)",
+                (self.namespace, self.namespace, overflow),
+            )
+            self.evictions += overflow
+        conn.execute(
+            "DELETE FROM cache_tags WHERE namespace = ? AND key NOT IN ("
+            "SELECT key FROM cache_entries WHERE namespace = ?)",
+            (self.namespace, self.namespace),
+        )
+
+    def _invalidate(self, tags) -> int:
+        conn = self._connection()
+        marks = ",".join("?" * len(tags))
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            removed = conn.execute(
+                f"DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                f"SELECT key FROM cache_tags WHERE namespace = ? AND tag IN ({marks}))",
+                (self.namespace, self.namespace, *tags),
+            ).rowcount
+            conn.execute(
+                f"DELETE FROM cache_tags WHERE namespace = ? AND tag IN ({marks})",
+                (self.namespace, *tags),
+            )
+        return removed
+
+    def clear(self) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+            conn.execute("DELETE FROM cache_tags WHERE namespace = ?", (self.namespace,))
+
+    def _size(self) -> int:
+        (size,) = self._connection().execute(
+            "SELECT count(*) FROM cache_entries WHERE namespace = ? AND expires > ?",
+            (self.namespace, time.time()),
+        ).fetchone()
+        return size
+
+
+class RedisCacheBackend(CacheBackend):
+    """Общий кеш на Redis-совместимом сервере
+
+    Метки — множества ключей; TTL и вытеснение выполняет сам сервер
+    (maxmemory-policy). Клиент можно передать явно (например, fakeredis в тестах).
+    """
+
+    kind = "redis"
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float, url: str = CACHE_REDIS_URL, client=None):
+        super().__init__(namespace, maxsize, ttl)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("CACHE_BACKEND=redis требует пакет redis (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = f"voidshop:cache:{namespace}:"
+
+    def _get(self, key):
+        raw = self.client.get(self.prefix + repr(key))
+        return pickle.loads(raw) if raw is not None else _MISSING
+
+    def _set(self, key, value, tags):
+        key = self.prefix + repr(key)
+        ttl = max(1, int(self.ttl))
+        pipe = self.client.pipeline()
+        pipe.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=ttl)
+        for tag in tags:
+            pipe.sadd(self.prefix + "tag:" + tag, key)
+            pipe.expire(self.prefix + "tag:" + tag, ttl)
+        pipe.execute()
+
+    def _invalidate(self, tags) -> int:
+        tag_keys = [self.prefix + "tag:" + tag for tag in tags]
+        keys = set(self.client.sunion(tag_keys)) if tag_keys else set()
+        removed = self.client.delete(*keys) if keys else 0
+        self.client.delete(*tag_keys)
+        return removed
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def _size(self) -> int:
+        return sum(1 for key in self.client.scan_iter(match=self.prefix + "*")
+                   if not key.decode().startswith(self.prefix + "tag:"))
+
+
+def create_cache(namespace: str, maxsize: int, ttl: float, backend: str = CACHE_BACKEND) -> CacheBackend:
+    if backend == "sqlite":
+        return SQLiteCacheBackend(namespace, maxsize, ttl, CACHE_SQLITE_PATH)
+    if backend == "redis":
+        return RedisCacheBackend(namespace, maxsize, ttl)
+    if backend != "memory":
+        logger.warning(f"Неизвестный CACHE_BACKEND={backend}, используется memory")
+    return MemoryCacheBackend(namespace, maxsize, ttl)
+
+
+def make_key(route: str, **params) -> tuple:
+    """Ключ кеша: маршрут + параметры в стабильном порядке"""
+    return (route, *sorted(params.items()))
+
+
+catalog_cache = create_cache("catalog", CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+settings_cache = create_cache("settings", 256, SETTINGS_CACHE_TTL)
+# order_id -> метаданные загруженного чека; после загрузки они не меняются, поэтому без меток таблиц
+receipt_cache = create_cache("receipts", RECEIPT_CACHE_SIZE, RECEIPT_CACHE_TTL)
+
+_CACHES = (catalog_cache, settings_cache, receipt_cache)
+
+
+# ---------- Инвалидация ----------
+
+_TAGS = {Store: "store", Product: "product", Category: "category", SystemSettings: "system_settings"}
+# Поля, изменение которых не должно сбрасывать кеш
+_IGNORED_ATTRS = {"views"}
+_CHANGED_KEY = "catalog_cache_changed"
+
+
+def _tag_for(obj) -> Optional[str]:
+    return _TAGS.get(type(obj))
+
+
+def _has_relevant_changes(obj) -> bool:
+    state = inspect(obj)
+    return any(
+        attr.history.has_changes()
+        for attr in state.attrs
+        if attr.key not in _IGNORED_ATTRS
+    )
+
+
+def invalidate(tags: Iterable[str]) -> None:
+    """Сбрасывает записи с метками во всех кешах (для изменений мимо ORM)"""
+    tags = set(tags)
+    for cache in _CACHES:
+        removed = cache.invalidate(tags)
+        logger.debug(f"Кеш {cache.namespace}: {sorted(tags)} изменены, удалено записей: {removed}")
+
+
+def changed_tables(session) -> set:
+    """Метки таблиц, которые меняет текущий flush (вызывать в after_flush)"""
+    changed = set()
+    for obj in list(session.new) + list(session.deleted):
+        tag = _tag_for(obj)
+        if tag:
+            changed.add(tag)
+    for obj in session.dirty:
+        tag = _tag_for(obj)
+        if tag and tag not in changed and _has_relevant_changes(obj):
+            changed.add(tag)
+    return changed
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_tables(session, flush_context):
+    changed = changed_tables(session)
+    if changed:
+        session.info.setdefault(_CHANGED_KEY, set()).update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    changed = session.info.pop(_CHANGED_KEY, None)
+    if changed:
+        invalidate(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_changed_tables(session):
+    session.info.pop(_CHANGED_KEY, None)
@@ -0,0 +1,91 @@
+# backend/captcha_glyphs.py - кеш шрифта и атлас символов капчи
+# Шрифт загружается один раз на процесс. Каждый символ CAPTCHA_CHARS заранее
+# растеризуется в маску (режим "L", обрезанную по рамке символа) в нескольких
+# толщинах штриха, и отрисовка капчи сводится к наложению готовой маски и ее
+# повороту. Атлас строится при старте (prebuild) в основном процессе и в каждом
+# процессе пула капч; размер ограничен CAPTCHA_GLYPH_CACHE_BYTES, при
+# переполнении вытесняются давно не использованные маски.
+from collections import OrderedDict
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+from typing import Iterable, Tuple
+import os
+import threading
+
+CAPTCHA_FONT_SIZE = 64
+CAPTCHA_GLYPH_WEIGHTS = (0, 1, 2)  # stroke_width
+CAPTCHA_GLYPH_CACHE_BYTES = int(os.getenv('CAPTCHA_GLYPH_CACHE_BYTES', str(4 * 1024 * 1024)))
+
+_GLYPH_PAD = 2
+
+_FONT_CANDIDATES = [
+    "arial.ttf",
+    "DejaVuSans.ttf",
+    "DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
+]
+
+
+@lru_cache(maxsize=4)
+def load_font(preferred_size: int):
+    """Первый доступный шрифт из списка; результат кешируется на процесс"""
+    for p in _FONT_CANDIDATES:
+        try:
+            # Pillow может найти часть шрифтов по имени, без полного пути
+            return ImageFont.truetype(p, preferred_size)
+        except Exception:
+            continue
+    return ImageFont.load_default()
+
+
+def _rasterize(ch: str, font, weight: int) -> Image.Image:
+    left, top, right, bottom = font.getbbox(ch, stroke_width=weight)
+    mask = Image.new("L", (right - left + _GLYPH_PAD * 2, bottom - top + _GLYPH_PAD * 2), 0)
+    ImageDraw.Draw(mask).text(
+        (_GLYPH_PAD - left, _GLYPH_PAD - top), ch, font=font, fill=255, stroke_width=weight, stroke_fill=255
+    )
+    return mask
+
+
+class GlyphAtlas:
+    def __init__(self, font_size: int = CAPTCHA_FONT_SIZE, weights: Tuple[int, ...] = CAPTCHA_GLYPH_WEIGHTS,
+                 max_bytes: int = CAPTCHA_GLYPH_CACHE_BYTES):
+        self.font_size = font_size
+        self.weights = weights
+        self.max_bytes = max_bytes
+        self._masks: "OrderedDict[Tuple[str, int], Image.Image]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.misses = 0
+
+    def get(self, ch: str, weight: int = 0) -> Image.Image:
+        """Маска символа (255 — символ), обрезанная по рамке с отступом 2 px"""
+        key = (ch, weight)
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        mask = _rasterize(ch, load_font(self.font_size), weight)
+        with self._lock:
+            self.misses += 1
+            if key not in self._masks:
+                self._masks[key] = mask
+                self._bytes += mask.width * mask.height
+                while self._bytes > self.max_bytes and len(self._masks) > 1:
+                    _, evicted = self._masks.popitem(last=False)
+                    self._bytes -= evicted.width * evicted.height
+        return mask
+
+    def prebuild(self, chars: Iterable[str]) -> int:
+        for ch in chars:
+            for weight in self.weights:
+                self.get(ch, weight)
+        return len(self._masks)
+
+    def stats(self) -> dict:
+        return {"glyphs": len(self._masks), "bytes": self._bytes, "max_bytes": self.max_bytes, "misses": self.misses}
+
+
+glyph_atlas = GlyphAtlas()
@@ -0,0 +1,194 @@
+# backend/captcha_numpy.py - векторизованный рендерер капчи (CAPTCHA_RENDERER=numpy)
+# Тот же стиль, что у generate_captcha_image в routes/captcha.py: полосы фона,
+# тонкие линии, повернутые символы со штрихами, кривые Безье, дуги, точки и
+# сглаживание SMOOTH. Все, кроме растеризации символов, делается операциями над
+# массивом, без попиксельных вызовов ImageDraw: маска символа берется из атласа
+# (backend/captcha_glyphs.py), поворот и скос применяются к ней одним аффинным
+# преобразованием.
+# Нужен пакет numpy.
+# Сравнение с рендерером Pillow: python -m backend.captcha_numpy [количество]
+from functools import lru_cache
+from PIL import Image
+import numpy as np
+
+from backend.captcha_glyphs import glyph_atlas
+
+_rng = np.random.default_rng()
+
+
+@lru_cache(maxsize=8)
+def _thickness_offsets(width: int) -> np.ndarray:
+    r = np.arange(-(width // 2), width - width // 2)
+    dy, dx = np.meshgrid(r, r, indexing="ij")
+    return np.stack([dx.ravel(), dy.ravel()], axis=1)
+
+
+def _stroke(canvas: np.ndarray, xs: np.ndarray, ys: np.ndarray, color, width: int = 1, alpha: float = 1.0):
+    """Закрашивает точки ломаной (xs, ys) толщиной width"""
+    h, w = canvas.shape[:2]
+    offsets = _thickness_offsets(width)
+    px = (np.rint(xs)[:, None] + offsets[:, 0]).ravel().astype(np.intp)
+    py = (np.rint(ys)[:, None] + offsets[:, 1]).ravel().astype(np.intp)
+    inside = (px >= 0) & (px < w) & (py >= 0) & (py < h)
+    px, py = px[inside], py[inside]
+    color = np.asarray(color, dtype=np.float32)
+    if alpha >= 1.0:
+        canvas[py, px] = color
+    else:
+        canvas[py, px] = canvas[py, px] * (1 - alpha) + color * alpha
+
+
+def _segment(start, end):
+    steps = int(max(abs(end[0] - start[0]), abs(end[1] - start[1]))) + 1
+    t = np.linspace(0.0, 1.0, steps + 1)
+    return start[0] + (end[0] - start[0]) * t, start[1] + (end[1] - start[1]) * t
+
+
+def _quadratic(start, control, end, steps: int):
+    t = np.linspace(0.0, 1.0, steps)
+    a, b, c = (1 - t) ** 2, 2 * (1 - t) * t, t ** 2
+    return a * start[0] + b * control[0] + c * end[0], a * start[1] + b * control[1] + c * end[1]
+
+
+def _glyph_mask(ch: str) -> np.ndarray:
+    """Маска символа (0..1) из атласа — растеризация Pillow выполняется один раз"""
+    mask = glyph_atlas.get(ch, int(_rng.choice(glyph_atlas.weights)))
+    return np.asarray(mask, dtype=np.float32) / 255.0
+
+
+def _warp_mask(mask: np.ndarray, angle: float, shear: float) -> np.ndarray:
+    """Поворот на angle градусов и горизонтальный скос одним аффинным
+    преобразованием с билинейной интерполяцией (вместо rotate + transform)"""
+    mh, mw = mask.shape
+    cos, sin = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    # прямое преобразование относительно центра: скос после поворота
+    forward = np.array([[1, shear], [0, 1]]) @ np.array([[cos, sin], [-sin, cos]])
+    corners = np.array([[-mw, -mh], [mw, -mh], [-mw, mh], [mw, mh]]) / 2 @ forward.T
+    ow, oh = np.ceil(corners.max(axis=0) - corners.min(axis=0)).astype(int) + 1
+
+    ys, xs = np.mgrid[0:oh, 0:ow].astype(np.float32)
+    inverse = np.linalg.inv(forward)
+    dx, dy = xs - (ow - 1) / 2, ys - (oh - 1) / 2
+    sx = inverse[0, 0] * dx + inverse[0, 1] * dy + (mw - 1) / 2
+    sy = inverse[1, 0] * dx + inverse[1, 1] * dy + (mh - 1) / 2
+
+    padded = np.pad(mask, 1)  # вне маски — прозрачность
+    sx = np.clip(sx + 1, 0, mw)
+    sy = np.clip(sy + 1, 0, mh)
+    x0, y0 = np.floor(sx).astype(np.intp), np.floor(sy).astype(np.intp)
+    x1, y1 = np.minimum(x0 + 1, mw + 1), np.minimum(y0 + 1, mh + 1)
+    fx, fy = sx - x0, sy - y0
+    top = padded[y0, x0] * (1 - fx) + padded[y0, x1] * fx
+    bottom = padded[y1, x0] * (1 - fx) + padded[y1, x1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def _blend(canvas: np.ndarray, mask: np.ndarray, x: int, y: int, color):
+    """Накладывает маску цветом color на canvas, обрезая по краям"""
+    h, w = canvas.shape[:2]
+    mh, mw = mask.shape
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + mw, w), min(y + mh, h)
+    if x0 >= x1 or y0 >= y1:
+        return
+    alpha = mask[y0 - y:y1 - y, x0 - x:x1 - x, None]
+    region = canvas[y0:y1, x0:x1]
+    region += (np.asarray(color, dtype=np.float32) - region) * alpha
+
+
+def _smooth(canvas: np.ndarray) -> np.ndarray:
+    """ImageFilter.SMOOTH: ядро 3x3 (1,1,1 / 1,5,1 / 1,1,1) / 13"""
+    p = np.pad(canvas, ((1, 1), (1, 1), (0, 0)), mode="edge")
+    total = (
+        p[:-2, :-2] + p[:-2, 1:-1] + p[:-2, 2:]
+        + p[1:-1, :-2] + 5 * p[1:-1, 1:-1] + p[1:-1, 2:]
+        + p[2:, :-2] + p[2:, 1:-1] + p[2:, 2:]
+    )
+    return total / 13
+
+
+def generate_captcha_image_numpy(text: str, size=(420, 140)) -> Image.Image:
+    w, h = size
+
+    # полосы фона: ширина 8 px, 6 оттенков
+    shades = 248 - (np.arange(w) // 8) % 6
+    canvas = np.repeat(np.broadcast_to(shades.astype(np.float32)[None, :, None], (h, w, 1)), 3, axis=2)
+
+    # тонкие линии
+    for _ in range(8):
+        start = (_rng.integers(0, w + 1), _rng.integers(0, h + 1))
+        end = (_rng.integers(0, w + 1), _rng.integers(0, h + 1))
+        _stroke(canvas, *_segment(start, end), color=(200, 200, 200))
+
+    margin = 20
+    per = int((w - margin * 2) / max(len(text), 1))
+    for i, ch in enumerate(text):
+        # темный цвет с небольшим разбросом, как в рендерере Pillow
+        base_gray = 18 + int(_rng.integers(0, 41))
+        color = (base_gray, base_gray + int(_rng.integers(0, 11)), base_gray + int(_rng.integers(0, 11)))
+        shear = float(_rng.uniform(-6, 6)) / 100.0 if _rng.random() < 0.6 else 0.0
+        mask = _warp_mask(_glyph_mask(ch), float(_rng.uniform(-28, 28)), shear)
+        # центр символа — в середине его ячейки со случайным сдвигом
+        cx = margin + i * per + per / 2 + int(_rng.integers(-10, 11))
+        cy = h / 2 + int(_rng.integers(-12, 13))
+        _blend(canvas, mask, int(cx - mask.shape[1] / 2), int(cy - mask.shape[0] / 2), color)
+        # два полупрозрачных штриха поверх символа
+        for _ in range(2):
+            start = (cx + _rng.integers(-per // 2 - 20, per // 2 + 20), _rng.integers(0, h))
+            end = (cx + _rng.integers(-per // 2 - 20, per // 2 + 20), _rng.integers(0, h))
+            _stroke(canvas, *_segment(start, end), color=(int(_rng.integers(80, 141)),) * 3, alpha=120 / 255)
+
+    # кривые через текст
+    for _ in range(4):
+        start = (_rng.integers(0, int(w * 0.2) + 1), _rng.integers(0, h + 1))
+        end = (_rng.integers(int(w * 0.8), w + 1), _rng.integers(0, h + 1))
+        control = (_rng.integers(int(w * 0.3), int(w * 0.7) + 1), _rng.integers(0, h + 1))
+        gray = int(_rng.integers(60, 121))
+        _stroke(canvas, *_quadratic(start, control, end, steps=w * 2), color=(gray,) * 3,
+                width=int(_rng.integers(2, 5)))
+
+    # дуги эллипсов
+    for _ in range(3):
+        box_w = int(_rng.integers(80, w // 2 + 1))
+        box_h = int(_rng.integers(30, h + 1))
+        x0 = int(_rng.integers(0, w - box_w + 1))
+        y0 = int(_rng.integers(0, max(0, h - box_h) + 1))
+        start_ang = float(_rng.integers(0, 361))
+        angles = np.radians(np.linspace(start_ang, start_ang + float(_rng.integers(60, 301)), box_w + box_h))
+        rx, ry = box_w / 2, box_h / 2
+        _stroke(canvas, x0 + rx + rx * np.cos(angles), y0 + ry + ry * np.sin(angles),
+                color=(int(_rng.integers(80, 151)),) * 3, width=int(_rng.integers(1, 4)))
+
+    # точки
+    count = 350
+    ys, xs = _rng.integers(0, h, count), _rng.integers(0, w, count)
+    canvas[ys, xs] = _rng.integers(60, 221, count)[:, None]
+
+    canvas = _smooth(canvas)
+    return Image.fromarray(np.clip(canvas + 0.5, 0, 255).astype(np.uint8), "RGB")
+
+
+def _benchmark(count: int = 200):
+    import io
+    import time
+    from backend.routes.captcha import generate_captcha_image, random_text
+
+    def encode(img):
+        img.save(io.BytesIO(), format="PNG")
+
+    for name, render in (("pillow", generate_captcha_image), ("numpy", generate_captcha_image_numpy)):
+        render(random_text())  # прогрев: шрифт, импорт
+        started = time.perf_counter()
+        for _ in range(count):
+            render(random_text())
+        render_ms = (time.perf_counter() - started) * 1000 / count
+        started = time.perf_counter()
+        for _ in range(count):
+            encode(render(random_text()))
+        total_ms = (time.perf_counter() - started) * 1000 / count
+        print(f"{name:>6}: отрисовка {render_ms:6.2f} мс, с PNG {total_ms:6.2f} мс")
+
+
+if __name__ == "__main__":
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,149 @@
+# backend/captcha_pool.py - пул заранее отрисованных капч
+# Картинки рисуются пачками в отдельных процессах и складываются в очередь
+# ограниченного размера; запрос капчи только забирает готовую пару
+# (answer_hash, data_url). Как только в пуле освободилось место, фоновая задача
+# дорисовывает недостающее. Если пул опустел (всплеск регистраций), запрос ждет
+# отрисовку в том же пуле процессов, не занимая пул потоков и event loop.
+# Если процесс пула аварийно завершился (BrokenProcessPool), пул пересоздается,
+# а до этого капчи рисуются в пуле потоков.
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+import os
+
+logger = logging.getLogger(__name__)
+
+CAPTCHA_POOL_SIZE = int(os.getenv('CAPTCHA_POOL_SIZE', '200'))
+CAPTCHA_POOL_WORKERS = int(os.getenv('CAPTCHA_POOL_WORKERS', '2'))
+CAPTCHA_POOL_BATCH = int(os.getenv('CAPTCHA_POOL_BATCH', '10'))
+
+Captcha = Tuple[str, str]  # (answer_hash, data_url)
+
+
+def _render_batch(render: Callable[[], Captcha], count: int) -> List[Captcha]:
+    return [render() for _ in range(count)]
+
+
+class CaptchaPool:
+    def __init__(self, render: Callable[[], Captcha], size: int = CAPTCHA_POOL_SIZE,
+                 workers: int = CAPTCHA_POOL_WORKERS, batch: int = CAPTCHA_POOL_BATCH,
+                 initializer: Optional[Callable[[], None]] = None):
+        # render и initializer должны быть функциями уровня модуля: они передаются в другой процесс
+        self.render = render
+        self.initializer = initializer
+        self.size = size
+        self.workers = workers
+        self.batch = batch
+        self._ready: deque = deque()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+
+    def start(self) -> None:
+        if self._task is not None or self.size <= 0 or self.workers <= 0:
+            return
+        self._executor = self._create_executor()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn: не наследуем потоки и соединения event loop'а
+        return ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=self.initializer
+        )
+
+    def _rebuild(self, broken: Optional[ProcessPoolExecutor]) -> None:
+        """Заменяет сломанный пул процессов (повторные вызовы для того же пула игнорируются)"""
+        if self._executor is not broken:
+            return
+        if broken is not None:
+            logger.warning("Пул процессов капчи сломан, пересоздается")
+            self.rebuilds += 1
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        try:
+            self._executor = self._create_executor()
+        except Exception as e:
+            # следующая попытка — в _run; пока капчи рисуются в пуле потоков
+            logger.warning(f"Не удалось пересоздать пул процессов капчи: {e}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._ready.clear()
+
+    async def get(self) -> Captcha:
+        """Готовая капча из пула; при пустом пуле — отрисовка в пуле процессов"""
+        if self._ready:
+            self.hits += 1
+            captcha = self._ready.popleft()
+            self._wakeup.set()
+            return captcha
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        if executor is None:
+            # пул не запущен (скрипты, тесты) или пересоздается — рисуем в пуле потоков
+            return await loop.run_in_executor(None, self.render)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        try:
+            return await loop.run_in_executor(executor, self.render)
+        except BrokenProcessPool:
+            self._rebuild(executor)
+            return await loop.run_in_executor(None, self.render)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            missing = self.size - len(self._ready)
+            if missing <= 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            executor = self._executor
+            if executor is None:
+                self._rebuild(None)
+                await asyncio.sleep(1)
+                continue
+            # по пачке на процесс: отрисовка и PNG-кодирование идут параллельно
+            counts = [min(self.batch, missing - i) for i in range(0, min(missing, self.batch * self.workers), self.batch)]
+            try:
+                results = await asyncio.gather(
+                    *(loop.run_in_executor(executor, _render_batch, self.render, count) for count in counts),
+                    return_exceptions=True,
+                )
+            except BrokenProcessPool as e:
+                # пул сломался еще до отправки задач: submit бросает исключение сразу
+                results = [e]
+            failed = False
+            for result in results:
+                if isinstance(result, BrokenProcessPool):
+                    failed = True
+                    self._rebuild(executor)
+                elif isinstance(result, BaseException):
+                    failed = True
+                    logger.warning(f"Не удалось отрисовать капчи для пула: {result}")
+                else:
+                    self._ready.extend(result[:self.size - len(self._ready)])
+            if failed:
+                await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        return {"ready": len(self._ready), "size": self.size, "hits": self.hits, "misses": self.misses,
+                "rebuilds": self.rebuilds}
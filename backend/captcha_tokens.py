@@ -0,0 +1,160 @@
+# backend/captcha_tokens.py - капча без строк в БД (CAPTCHA_MODE=stateless)
+# Токен — подписанная HMAC строка "<nonce>.<expires>.<answer_mac>.<sig>":
+#   answer_mac — HMAC от hash ответа (сам hash не отдаем: 5 символов перебираются за секунды);
+#   sig        — подпись всего токена, поддельный токен отбрасывается без обращения к хранилищу.
+# Одноразовость обеспечивает множество использованных nonce с истечением по
+# expires и ограниченным размером: в памяти процесса или общее для воркеров
+# (CAPTCHA_REPLAY_BACKEND: memory / sqlite / redis, по умолчанию как CACHE_BACKEND).
+# Для нескольких воркеров задайте общий CAPTCHA_SECRET.
+from collections import OrderedDict
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from backend.cache import CACHE_BACKEND, CACHE_SQLITE_PATH, CACHE_REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+CAPTCHA_MODE = os.getenv('CAPTCHA_MODE', 'db').strip().lower()
+CAPTCHA_TTL = int(os.getenv('CAPTCHA_TTL', '360'))
+CAPTCHA_REPLAY_SIZE = int(os.getenv('CAPTCHA_REPLAY_SIZE', '100000'))
+CAPTCHA_REPLAY_BACKEND = os.getenv('CAPTCHA_REPLAY_BACKEND', CACHE_BACKEND).strip().lower()
+
+_SECRET = os.getenv('CAPTCHA_SECRET', '').encode()
+if not _SECRET:
+    _SECRET = secrets.token_bytes(32)
+    if CAPTCHA_MODE == 'stateless':
+        logger.warning("CAPTCHA_SECRET не задан: токены капчи действительны только в этом процессе")
+
+# результаты verify()
+OK, WRONG, EXPIRED, INVALID, USED = "ok", "wrong", "expired", "invalid", "used"
+
+
+def is_stateless_token(token: str) -> bool:
+    """Токены из БД — uuid4 без точек"""
+    return token.count(".") == 3
+
+
+def _mac(*parts) -> str:
+    return hmac.new(_SECRET, "|".join(str(p) for p in parts).encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def issue(answer_hash: str, ttl: int = CAPTCHA_TTL) -> str:
+    nonce = secrets.token_hex(8)
+    expires = int(time.time()) + ttl
+    answer_mac = _mac("answer", nonce, expires, answer_hash)
+    return f"{nonce}.{expires}.{answer_mac}.{_mac('token', nonce, expires, answer_mac)}"
+
+
+def verify(token: str, answer_hash: str) -> str:
+    """Проверяет ответ; токен одноразовый при любом исходе проверки"""
+    try:
+        nonce, expires, answer_mac, sig = token.split(".")
+        expires = int(expires)
+    except ValueError:
+        return INVALID
+    if not hmac.compare_digest(sig, _mac("token", nonce, expires, answer_mac)):
+        return INVALID
+    if time.time() > expires:
+        return EXPIRED
+    if not replay_guard.claim(nonce, expires):
+        return USED
+    if not hmac.compare_digest(answer_mac, _mac("answer", nonce, expires, answer_hash)):
+        return WRONG
+    return OK
+
+
+class MemoryReplayGuard:
+    """Использованные nonce в памяти процесса (один воркер)"""
+
+    def __init__(self, maxsize: int = CAPTCHA_REPLAY_SIZE):
+        self.maxsize = maxsize
+        self._used: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, nonce: str, expires: int) -> bool:
+        """True, если nonce использован впервые"""
+        now = time.time()
+        with self._lock:
+            # TTL у всех токенов одинаковый: порядок вставки совпадает с порядком истечения
+            while self._used:
+                oldest, oldest_expires = next(iter(self._used.items()))
+                if oldest_expires >= now:
+                    break
+                self._used.popitem(last=False)
+            if nonce in self._used:
+                return False
+            self._used[nonce] = expires
+            if len(self._used) > self.maxsize:
+                self._used.popitem(last=False)
+            return True
+
+
+class SQLiteReplayGuard:
+    """Общее множество nonce в файле кеша для воркеров на одной машине"""
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, maxsize: int = CAPTCHA_REPLAY_SIZE):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS captcha_nonces (nonce TEXT PRIMARY KEY, expires INTEGER NOT NULL)"
+        )
+        self._connection().execute("CREATE INDEX IF NOT EXISTS ix_captcha_nonces_expires ON captcha_nonces (expires)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def claim(self, nonce: str, expires: int) -> bool:
+        conn = self._connection()
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO captcha_nonces (nonce, expires) VALUES (?, ?)", (nonce, expires)
+        ).rowcount == 1
+        if inserted and secrets.randbelow(100) == 0:
+            # изредка чистим истекшие и лишние записи
+            conn.execute("DELETE FROM captcha_nonces WHERE expires < ?", (int(time.time()),))
+            conn.execute(
+                "DELETE FROM captcha_nonces WHERE nonce IN ("
+                "SELECT nonce FROM captcha_nonces ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.maxsize,)
+            )
+        return inserted
+
+
+class RedisReplayGuard:
+    """Общее множество nonce в Redis: SET NX с истечением вместе с токеном"""
+
+    def __init__(self, url: str = CACHE_REDIS_URL, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("CAPTCHA_REPLAY_BACKEND=redis требует пакет redis (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = "voidshop:captcha:used:"
+
+    def claim(self, nonce: str, expires: int) -> bool:
+        ttl = max(1, expires - int(time.time()))
+        return bool(self.client.set(self.prefix + nonce, 1, nx=True, ex=ttl))
+
+
+def create_replay_guard(backend: str = CAPTCHA_REPLAY_BACKEND):
+    if backend == "sqlite":
+        return SQLiteReplayGuard()
+    if backend == "redis":
+        return RedisReplayGuard()
+    return MemoryReplayGuard()
+
+
+replay_guard = create_replay_guard()
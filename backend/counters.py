@@ -0,0 +1,170 @@
+# backend/counters.py - денормализованные счетчики товаров (Category / Store)
+# Счетчики products_count обновляются в той же транзакции, что и сам Product:
+# обработчики сессии ловят создание, удаление и смену status/category/store_id.
+# Массовые UPDATE мимо ORM счетчики не видят — для починки есть rebuild_counters().
+# Проверка: python -m backend.counters --check (расхождения с COUNT(*)).
+# Пересборка вручную: python -m backend.counters (версии таблиц увеличиваются,
+# кеш каталога сбрасывается — клиенты не получат 304 со старыми счетчиками).
+from collections import Counter
+from sqlalchemy import event, update, select, func, inspect
+from sqlalchemy.orm import Session
+from typing import List, Tuple
+import logging
+
+from backend.models import Product, Category, Store, ProductStatus
+from backend.versions import bump_versions
+
+logger = logging.getLogger(__name__)
+
+_DELTAS_KEY = "product_counter_deltas"
+# метки кеша и версий таблиц, которые меняет rebuild_counters()
+REBUILD_TAGS = ("category", "store")
+
+
+def _is_counted(status) -> bool:
+    """В счетчики попадают только активные товары"""
+    return status == ProductStatus.ACTIVE
+
+
+def _committed_values(session, ids) -> dict:
+    """{id: (status, category, store_id)} из БД — значения до текущего flush.
+
+    История атрибутов не годится: после коммита атрибуты истекают, и у
+    удаляемого или измененного без загрузки товара старых значений в ней нет.
+    """
+    if not ids:
+        return {}
+    rows = session.connection().execute(
+        select(Product.id, Product.status, Product.category, Product.store_id).where(Product.id.in_(ids))
+    )
+    return {row.id: (row.status, row.category, row.store_id) for row in rows}
+
+
+def _contribution(status, category, store_id):
+    if not _is_counted(status):
+        return None
+    return category, store_id
+
+
+def _apply(deltas, key, sign: int):
+    if key is None:
+        return
+    category, store_id = key
+    if category:
+        deltas["category"][category] += sign
+    if store_id:
+        deltas["store"][store_id] += sign
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_product_deltas(session, flush_context, instances):
+    deltas = {"category": Counter(), "store": Counter()}
+
+    for obj in session.new:
+        if isinstance(obj, Product):
+            _apply(deltas, _contribution(obj.status, obj.category, obj.store_id), +1)
+
+    deleted = [obj for obj in session.deleted if isinstance(obj, Product)]
+    changed = [
+        obj for obj in session.dirty
+        if isinstance(obj, Product)
+        and any(inspect(obj).attrs[a].history.has_changes() for a in ("status", "category", "store_id"))
+    ]
+    # id берем из ключа identity: обращение к истекшему obj.id — лишний SELECT
+    committed = _committed_values(session, [inspect(obj).identity[0] for obj in deleted + changed])
+
+    for obj in deleted:
+        old = committed.get(inspect(obj).identity[0])
+        _apply(deltas, _contribution(*old) if old else None, -1)
+
+    for obj in changed:
+        old = committed.get(inspect(obj).identity[0])
+        old = _contribution(*old) if old else None
+        new = _contribution(obj.status, obj.category, obj.store_id)
+        if old != new:
+            _apply(deltas, old, -1)
+            _apply(deltas, new, +1)
+
+    if any(deltas.values()):
+        session.info[_DELTAS_KEY] = deltas
+
+
+@event.listens_for(Session, "after_flush")
+def _write_product_deltas(session, flush_context):
+    deltas = session.info.pop(_DELTAS_KEY, None)
+    if not deltas:
+        return
+    conn = session.connection()
+    for slug, delta in deltas["category"].items():
+        if delta:
+            conn.execute(
+                update(Category)
+                .where(Category.slug == slug)
+                .values(products_count=Category.products_count + delta)
+            )
+    for store_id, delta in deltas["store"].items():
+        if delta:
+            conn.execute(
+                update(Store)
+                .where(Store.id == store_id)
+                .values(products_count=Store.products_count + delta)
+            )
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_product_deltas(session):
+    session.info.pop(_DELTAS_KEY, None)
+
+
+def rebuild_counters(conn) -> None:
+    """Пересчитывает все счетчики с нуля (починка расхождений)"""
+    active = Product.status == ProductStatus.ACTIVE
+    conn.execute(update(Category).values(products_count=(
+        select(func.count(Product.id))
+        .where(Product.category == Category.slug, active)
+        .scalar_subquery()
+    )))
+    conn.execute(update(Store).values(products_count=(
+        select(func.count(Product.id))
+        .where(Product.store_id == Store.id, active)
+        .scalar_subquery()
+    )))
+    # UPDATE мимо ORM: версии для ETag увеличиваем сами, в той же транзакции
+    bump_versions(conn, REBUILD_TAGS)
+    logger.info("✅ Счетчики товаров пересобраны")
+
+
+def counter_mismatches(conn) -> List[Tuple[str, object, int, int]]:
+    """Расхождения счетчиков с COUNT(*) активных товаров: (таблица, ключ, счетчик, факт)"""
+    active = Product.status == ProductStatus.ACTIVE
+    mismatches = []
+    for table, model, key, product_key in (
+        ("category", Category, Category.slug, Product.category),
+        ("store", Store, Store.id, Product.store_id),
+    ):
+        actual = select(func.count(Product.id)).where(product_key == key, active).scalar_subquery()
+        rows = conn.execute(select(key, model.products_count, actual).where(model.products_count != actual))
+        mismatches.extend((table, row[0], row[1], row[2]) for row in rows)
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    from backend.cache import invalidate
+    from backend.db import engine
+
+    if "--check" in sys.argv[1:]:
+        # только проверка: python -m backend.counters --check
+        with engine.connect() as connection:
+            found = counter_mismatches(connection)
+        for table, key, stored, actual in found:
+            print(f"❌ {table} {key}: products_count={stored}, товаров={actual}")
+        print("✅ Счетчики совпадают" if not found else f"Расхождений: {len(found)}")
+        sys.exit(1 if found else 0)
+
+    with engine.begin() as connection:
+        rebuild_counters(connection)
+    # после коммита: общий кеш (sqlite / redis) не должен отдавать старые счетчики
+    invalidate(REBUILD_TAGS)
+    print("✅ Счетчики товаров пересобраны")
@@ -1,5 +1,10 @@
 ﻿# backend/db.py
 from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from contextlib import contextmanager, asynccontextmanager
+import asyncio
+import threading
 import os
 from dotenv import load_dotenv
 
@@ -7,11 +12,189 @@ load_dotenv()
 
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./voidshop.db')
 
-# синхронный engine (удобно для dev и прост)
-engine = create_engine(DATABASE_URL, echo=False, connect_args={'check_same_thread': False})
+# Настройки пула соединений (для SQLite в памяти пул не используется)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1').strip() == '1'
+DB_ECHO = os.getenv('DB_ECHO', '').strip() == '1'
+
+# Продакшен-профиль SQLite (SQLITE_PROFILE=production): WAL, настроенные pragma
+# и единственный писатель. По умолчанию выключен — поведение как раньше.
+SQLITE_PRODUCTION = os.getenv('SQLITE_PROFILE', '').strip().lower() == 'production'
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', '-65536'))  # отрицательное значение — в KiB (64MB)
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))  # мс
+SQLITE_PRAGMAS = [
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    f"mmap_size={SQLITE_MMAP_SIZE}",
+    f"cache_size={SQLITE_CACHE_SIZE}",
+    f"busy_timeout={SQLITE_BUSY_TIMEOUT}",
+    "temp_store=MEMORY",
+]
+
+# Соответствие синхронных и асинхронных драйверов
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+SYNC_DRIVERS = {v: k for k, v in ASYNC_DRIVERS.items()}
+
+
+def _sync_url(url: str) -> str:
+    """Возвращает URL с синхронным драйвером"""
+    parsed = make_url(url)
+    driver = SYNC_DRIVERS.get(parsed.drivername)
+    return parsed.set(drivername=driver).render_as_string(hide_password=False) if driver else url
+
+
+def _async_url(url: str) -> str:
+    """Возвращает URL с асинхронным драйвером"""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername)
+    return parsed.set(drivername=driver).render_as_string(hide_password=False) if driver else url
+
+
+# DATABASE_URL может указывать как синхронный, так и async-драйвер
+# (например sqlite+aiosqlite:///./voidshop.db или postgresql+asyncpg://...):
+# парный URL для второго engine выводится автоматически
+SYNC_DATABASE_URL = _sync_url(DATABASE_URL)
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL', _async_url(DATABASE_URL))
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == 'sqlite' and parsed.database in (None, '', ':memory:')
+
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == 'sqlite'
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Применяет pragma продакшен-профиля к каждому новому соединению пула"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(f"PRAGMA {pragma}")
+    finally:
+        cursor.close()
+
+
+def _setup_sqlite_profile(sync_engine, url: str):
+    if SQLITE_PRODUCTION and _is_sqlite(url) and not _is_memory_sqlite(url):
+        event.listen(sync_engine, 'connect', _apply_sqlite_pragmas)
+
+
+def _engine_kwargs(url: str) -> dict:
+    kwargs = {'echo': DB_ECHO, 'pool_pre_ping': DB_POOL_PRE_PING}
+    if _is_sqlite(url):
+        kwargs['connect_args'] = {'check_same_thread': False}
+    if not _is_memory_sqlite(url):
+        kwargs.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    return kwargs
+
+
+# синхронный engine: create_all, скрипты, бот и синхронные роуты
+engine = create_engine(SYNC_DATABASE_URL, **_engine_kwargs(SYNC_DATABASE_URL))
+_setup_sqlite_profile(engine, SYNC_DATABASE_URL)
+
+# асинхронный engine создается лениво, чтобы скрипты без aiosqlite/asyncpg работали
+_async_engine = None
+_async_sessionmaker = None
+
+
+def get_async_engine():
+    """Возвращает (и при первом вызове создает) асинхронный engine"""
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        from sqlmodel.ext.asyncio.session import AsyncSession
+
+        _async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_kwargs(ASYNC_DATABASE_URL))
+        _setup_sqlite_profile(_async_engine.sync_engine, ASYNC_DATABASE_URL)
+        _async_sessionmaker = async_sessionmaker(_async_engine, class_=AsyncSession, expire_on_commit=False)
+    return _async_engine
+
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
 
+
 def get_session():
     return Session(engine)
+
+
+# Единственный писатель: в продакшен-профиле SQLite все пишущие транзакции
+# процесса выполняются строго по очереди, поэтому писатели не конкурируют
+# за блокировку файла, а читатели в WAL-режиме вообще не блокируются
+_write_lock = threading.Lock()
+
+
+@contextmanager
+def write_guard(always: bool = False):
+    """Сериализует пишущую транзакцию (синхронный код)
+
+    always=True — блокировка берется в любом профиле (файлы чеков согласуются
+    с записями ReceiptFile, см. backend/reaper.py); действует в пределах процесса.
+    """
+    if not (SQLITE_PRODUCTION or always):
+        yield
+        return
+    with _write_lock:
+        yield
+
+
+@asynccontextmanager
+async def async_write_guard(always: bool = False):
+    """Сериализует пишущую транзакцию (асинхронный код), не блокируя event loop"""
+    if not (SQLITE_PRODUCTION or always):
+        yield
+        return
+    acquiring = asyncio.get_running_loop().run_in_executor(None, _write_lock.acquire)
+    try:
+        await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # блокировка все равно будет получена в потоке — сразу отпускаем ее
+        acquiring.add_done_callback(lambda _: _write_lock.release())
+        raise
+    try:
+        yield
+    finally:
+        _write_lock.release()
+
+
+@contextmanager
+def write_session():
+    """Синхронная сессия для записи через единственного писателя"""
+    with write_guard(), Session(engine) as session:
+        yield session
+
+
+@asynccontextmanager
+async def async_session_scope():
+    """Асинхронная сессия как контекстный менеджер (для фоновых задач)"""
+    get_async_engine()
+    async with _async_sessionmaker() as session:
+        yield session
+
+
+async def get_async_session():
+    """FastAPI-зависимость: асинхронная сессия на время запроса"""
+    async with async_session_scope() as session:
+        yield session
+
+
+async def dispose_engines():
+    """Закрывает пулы соединений при остановке приложения"""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    engine.dispose()
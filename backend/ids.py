@@ -0,0 +1,46 @@
+# backend/ids.py - генератор ID заявок без обращения к БД
+# Формат: VB + 13 цифр времени в мс + 2 цифры воркера + 3 цифры счетчика
+# (20 символов, только буквы и цифры — ID идет в callback_data бота через "_").
+# Внутри процесса ID строго возрастают, поэтому совпасть не могут; разные
+# процессы различаются номером воркера. ID упорядочены по времени создания,
+# новые записи ложатся в конец индекса order_id.
+# На нескольких машинах задайте каждому процессу свой ORDER_ID_WORKER (0-99).
+# Без него номер воркера — pid % 100, и у двух процессов он может совпасть;
+# тогда вставка заявки падает на уникальном индексе и повторяется с новым ID.
+import os
+import threading
+import time
+
+ORDER_ID_PREFIX = "VB"
+_SEQUENCE_SIZE = 1000
+
+
+def _default_worker_id() -> int:
+    value = os.getenv('ORDER_ID_WORKER', '').strip()
+    return int(value) if value else os.getpid()
+
+
+class OrderIdGenerator:
+    def __init__(self, worker_id: int, prefix: str = ORDER_ID_PREFIX):
+        self.prefix = prefix
+        self.worker_id = worker_id % 100
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def __call__(self) -> str:
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # та же миллисекунда или часы ушли назад: продолжаем от последней метки
+                self._sequence += 1
+                if self._sequence >= _SEQUENCE_SIZE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return f"{self.prefix}{self._last_ms:013d}{self.worker_id:02d}{self._sequence:03d}"
+
+
+generate_order_id = OrderIdGenerator(_default_worker_id())
@@ -0,0 +1,205 @@
+# backend/migrations.py - версионные миграции схемы
+# Запуск вручную: python -m backend.migrations
+# Также выполняются автоматически при старте backend (после create_all)
+from sqlalchemy import text, inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+import logging
+import os
+import shutil
+
+from backend.db import engine
+from backend import models, counters, search, receipts
+
+logger = logging.getLogger(__name__)
+
+
+def _m0001_catalog_indexes(conn: Connection):
+    """Составные индексы для горячих запросов каталога"""
+    for index in models.CATALOG_INDEXES:
+        index.create(conn, checkfirst=True)
+    if conn.dialect.name == 'sqlite':
+        # обновляем статистику, чтобы планировщик сразу начал выбирать новые индексы
+        conn.execute(text("ANALYZE"))
+
+
+def _add_column_if_missing(conn: Connection, table: str, column: str, ddl: str):
+    existing = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _m0002_products_counters(conn: Connection):
+    """Счетчики products_count для категорий и магазинов"""
+    _add_column_if_missing(conn, "category", "products_count", "INTEGER NOT NULL DEFAULT 0")
+    _add_column_if_missing(conn, "store", "products_count", "INTEGER NOT NULL DEFAULT 0")
+    counters.rebuild_counters(conn)
+
+
+_PRODUCT_FTS_COLUMNS = "title, short_description, description, tags, category"
+
+
+def _m0003_product_fts(conn: Connection):
+    """FTS5-индекс для поиска товаров (только SQLite; заменен индексом 0004)"""
+    if conn.dialect.name != 'sqlite':
+        logger.info("FTS5 доступен только для SQLite — поиск останется на ilike")
+        return
+    cols = _PRODUCT_FTS_COLUMNS
+    new_cols = ", ".join(f"new.{c.strip()}" for c in cols.split(","))
+    old_cols = ", ".join(f"old.{c.strip()}" for c in cols.split(","))
+    try:
+        with conn.begin_nested():
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+                f"{cols}, content='product', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN "
+                f"INSERT INTO product_fts(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN "
+                f"INSERT INTO product_fts(product_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF {cols} ON product BEGIN "
+                f"INSERT INTO product_fts(product_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+                f"INSERT INTO product_fts(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+            ))
+            conn.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+    except OperationalError as e:
+        logger.warning(f"⚠️ FTS5 недоступен в этой сборке SQLite, поиск останется на ilike: {e}")
+
+
+def _m0004_russian_search(conn: Connection):
+    """Стемированные индексы товаров и магазинов + словарь для опечаток"""
+    if conn.dialect.name != 'sqlite':
+        return
+    for trigger in ("product_fts_ai", "product_fts_ad", "product_fts_au"):
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+    conn.execute(text("DROP TABLE IF EXISTS product_fts"))
+    try:
+        with conn.begin_nested():
+            search.create_search_index(conn)
+    except OperationalError as e:
+        logger.warning(f"⚠️ FTS5 недоступен в этой сборке SQLite, поиск останется на ilike: {e}")
+
+
+def _m0005_receipt_sha256(conn: Connection):
+    """SHA-256 загруженного чека"""
+    _add_column_if_missing(conn, "balancerequest", "receipt_sha256", "VARCHAR(64)")
+
+
+def _m0006_receipt_store(conn: Connection):
+    """Перенос чеков в хранилище по хешу (ab/cd/<sha256><ext>)"""
+    rows = conn.execute(text(
+        "SELECT id, receipt_path FROM balancerequest WHERE receipt_path IS NOT NULL"
+    )).all()
+    old_paths = set()
+    for request_id, path in rows:
+        if not os.path.isfile(path):
+            logger.warning(f"⚠️ Чек заявки {request_id} не найден на диске: {path}")
+            continue
+        sha256 = receipts.file_sha256(path)
+        new_path = receipts.receipt_path(os.path.dirname(path), sha256, os.path.splitext(path)[1].lower())
+        # одинаковые чеки с разными расширениями ссылаются на один файл
+        new_path = receipts.register(conn, sha256, new_path, os.path.getsize(path))
+        if not os.path.exists(new_path):
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            shutil.copy2(path, new_path)
+        if new_path != path:
+            old_paths.add(path)
+        conn.execute(
+            text("UPDATE balancerequest SET receipt_path = :p, receipt_sha256 = :h WHERE id = :id"),
+            {"p": new_path, "h": sha256, "id": request_id}
+        )
+
+    def remove_old_files():
+        # старые файлы удаляются только после коммита: при откате заявки ссылаются на них
+        for old_path in old_paths:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+        logger.info(f"Чеки перенесены в хранилище по хешу: {len(old_paths)} файлов")
+
+    return remove_old_files
+
+
+def _m0007_ttl_indexes(conn: Connection):
+    """Индексы по сроку жизни строк для фоновой очистки"""
+    for index in models.TTL_INDEXES:
+        index.create(conn, checkfirst=True)
+
+
+def _m0008_drop_receipt_ref_count(conn: Connection):
+    """Убираем ReceiptFile.ref_count: файлы чеков не удаляются по счетчику ссылок"""
+    existing = {col["name"] for col in inspect(conn).get_columns("receiptfile")}
+    if "ref_count" in existing:
+        conn.execute(text("ALTER TABLE receiptfile DROP COLUMN ref_count"))
+
+
+# (версия, название, функция). Новые миграции добавляются только в конец.
+# Функция может вернуть действие, которое выполняется после коммита миграции
+# (например, удаление файлов, на которые до коммита еще ссылается база).
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], Optional[Callable[[], None]]]]] = [
+    (1, "catalog_hot_path_indexes", _m0001_catalog_indexes),
+    (2, "products_counters", _m0002_products_counters),
+    (3, "product_fts", _m0003_product_fts),
+    (4, "russian_search", _m0004_russian_search),
+    (5, "receipt_sha256", _m0005_receipt_sha256),
+    (6, "receipt_store", _m0006_receipt_store),
+    (7, "ttl_indexes", _m0007_ttl_indexes),
+    (8, "drop_receipt_ref_count", _m0008_drop_receipt_ref_count),
+]
+
+
+def _ensure_migrations_table(conn: Connection):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(255) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def applied_versions(conn: Connection) -> set:
+    _ensure_migrations_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def run_migrations(bind=None) -> List[int]:
+    """Применяет все непримененные миграции, каждую в своей транзакции"""
+    bind = bind or engine
+    with bind.begin() as conn:
+        done = applied_versions(conn)
+
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        logger.info(f"🔄 Миграция {version:04d}_{name}")
+        with bind.begin() as conn:
+            after_commit = migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.now(timezone.utc)}
+            )
+        if after_commit is not None:
+            after_commit()
+        applied.append(version)
+
+    if applied:
+        logger.info(f"✅ Применено миграций: {len(applied)}")
+    return applied
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from backend.db import create_db_and_tables
+
+    create_db_and_tables()
+    versions = run_migrations()
+    print(f"✅ Применены миграции: {versions}" if versions else "✅ Схема уже актуальна")
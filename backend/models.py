@@ -1,5 +1,6 @@
 ﻿# backend/models.py - ИСПРАВЛЕНО: все datetime теперь timezone-aware
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index
 from typing import Optional, List
 from datetime import datetime, timezone, timedelta
 import uuid
@@ -95,6 +96,9 @@ class Store(SQLModel, table=True):
     avatar_url: Optional[str] = Field(default=None, max_length=500)
     banner_url: Optional[str] = Field(default=None, max_length=500)
 
+    # Денормализованный счетчик активных товаров (см. backend/counters.py)
+    products_count: int = Field(default=0)
+
     products: List["Product"] = Relationship(back_populates="store")
     reviews: List["StoreReview"] = Relationship(back_populates="store")
 
@@ -129,6 +133,22 @@ class Product(SQLModel, table=True):
     reviews: List["ProductReview"] = Relationship(back_populates="product")
 
 
+# Составные индексы под реальные фильтры и сортировки каталога (routes/store.py).
+# На новой БД их создает create_all, на существующей — миграция 0001.
+CATALOG_INDEXES = [
+    # категория: WHERE status, category ORDER BY views DESC, created_at DESC
+    Index("ix_product_status_category_views", Product.status, Product.category, Product.views.desc(), Product.created_at.desc()),
+    # товары магазина: WHERE store_id, status ORDER BY created_at DESC
+    Index("ix_product_store_status_created", Product.store_id, Product.status, Product.created_at.desc()),
+    # поиск без категории: WHERE status ORDER BY views DESC, created_at DESC
+    Index("ix_product_status_views_created", Product.status, Product.views.desc(), Product.created_at.desc()),
+    # список магазинов и рекомендуемые: WHERE status [AND is_featured] ORDER BY is_featured, rating DESC
+    Index("ix_store_status_featured_rating", Store.status, Store.is_featured, Store.rating.desc()),
+    # приоритет города в выдаче магазинов
+    Index("ix_store_status_city", Store.status, Store.city),
+]
+
+
 class BalanceRequest(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     order_id: str = Field(unique=True, index=True)
@@ -148,6 +168,7 @@ class BalanceRequest(SQLModel, table=True):
     receipt_filename: Optional[str] = Field(default=None, max_length=255)
     receipt_mimetype: Optional[str] = Field(default=None, max_length=100)
     receipt_size: Optional[int] = Field(default=None)
+    receipt_sha256: Optional[str] = Field(default=None, max_length=64)
 
     admin_comment: Optional[str] = Field(default=None, max_length=500)
     admin_id: Optional[int] = Field(default=None)
@@ -159,6 +180,14 @@ class BalanceRequest(SQLModel, table=True):
     user: Optional[User] = Relationship()
 
 
+# Индексы для очистки устаревших строк (backend/reaper.py); на существующей БД — миграция 0007.
+TTL_INDEXES = [
+    Index("ix_captcharequest_expires_at", CaptchaRequest.expires_at),
+    # брошенные заявки: WHERE status = 'pending' AND created_at < ...
+    Index("ix_balancerequest_status_created", BalanceRequest.status, BalanceRequest.created_at),
+]
+
+
 class SystemSettings(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     key: str = Field(max_length=100, unique=True, index=True)
@@ -172,6 +201,22 @@ class SystemSettings(SQLModel, table=True):
     is_protected: bool = Field(default=False)
 
 
+class ReceiptFile(SQLModel, table=True):
+    # Файл чека в контентно-адресуемом хранилище (см. backend/receipts.py)
+    sha256: str = Field(primary_key=True, max_length=64)
+    path: str = Field(max_length=500)
+    size: int = Field(default=0)
+    telegram_file_id: Optional[str] = Field(default=None, max_length=255)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class TableVersion(SQLModel, table=True):
+    # Версия таблицы растет с каждым коммитом, который ее меняет (см. backend/versions.py)
+    name: str = Field(primary_key=True, max_length=50)
+    version: int = Field(default=0)
+    changed_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
 class Order(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     order_id: str = Field(unique=True, index=True)
@@ -256,4 +301,7 @@ class Category(SQLModel, table=True):
     parent: Optional["Category"] = Relationship(sa_relationship_kwargs={"remote_side": "Category.id"})
     is_active: bool = Field(default=True)
     sort_order: int = Field(default=0)
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
\ No newline at end of file
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    # Денормализованный счетчик активных товаров (см. backend/counters.py)
+    products_count: int = Field(default=0)
\ No newline at end of file
@@ -0,0 +1,90 @@
+# backend/pagination.py - keyset (cursor) пагинация для каталога
+# Курсор — непрозрачный base64-токен со значениями ключей сортировки последней
+# строки страницы. Следующая страница выбирается условием "строго после этих
+# значений", поэтому глубокая страница стоит столько же, сколько первая.
+# offset остается только для обратной совместимости.
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, or_, literal
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+import base64
+import json
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _encode_value(value: Any):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, expected_len: int) -> List[Any]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(values, list) or len(values) != expected_len:
+            raise ValueError("cursor length mismatch")
+        return [_decode_value(v) for v in values]
+    except Exception:
+        raise HTTPException(status_code=400, detail='Некорректный курсор пагинации')
+
+
+class Keyset:
+    """Порядок сортировки [(выражение, по убыванию)] с уникальным ключом в конце
+
+    Значения ключей выбираются вместе со строками: запрос строится как
+    select(Model, *keyset.columns), иначе курсор не из чего собрать.
+    """
+
+    def __init__(self, keys: List[Tuple[Any, bool]]):
+        self.keys = keys
+
+    @property
+    def columns(self) -> list:
+        return [expr.label(f"_keyset_{i}") for i, (expr, _) in enumerate(self.keys)]
+
+    def _after(self, values: Sequence[Any]):
+        # (k1 after v1) OR (k1 = v1 AND k2 after v2) OR ...
+        # значения связываются параметрами: True/False из "city == :city" сравниваются как 1/0
+        bound = [literal(v) for v in values]
+        clauses = []
+        for i, (expr, descending) in enumerate(self.keys):
+            equal_prefix = [self.keys[j][0] == bound[j] for j in range(i)]
+            after = expr < bound[i] if descending else expr > bound[i]
+            clauses.append(and_(*equal_prefix, after))
+        return or_(*clauses)
+
+    def apply(self, stmt, cursor: Optional[str], offset: int, limit: int):
+        """Добавляет сортировку, условие курсора (или offset) и limit + 1"""
+        stmt = stmt.order_by(*[expr.desc() if descending else expr.asc() for expr, descending in self.keys])
+        if cursor:
+            stmt = stmt.where(self._after(decode_cursor(cursor, len(self.keys))))
+        elif offset:
+            stmt = stmt.offset(offset)
+        # одна лишняя строка показывает, есть ли следующая страница
+        return stmt.limit(limit + 1)
+
+    def split(self, rows: Sequence[Any], limit: int) -> Tuple[list, Optional[str]]:
+        """Отрезает служебные колонки ключей и строит курсор следующей страницы"""
+        n = len(self.keys)
+        page = rows[:limit]
+        items = [row[0] if len(row) - n == 1 else tuple(row[:-n]) for row in page]
+        next_cursor = encode_cursor(list(page[-1][-n:])) if len(rows) > limit and page else None
+        return items, next_cursor
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
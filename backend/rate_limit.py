@@ -0,0 +1,251 @@
+# backend/rate_limit.py - ограничение частоты запросов (token bucket)
+# Дорогие эндпоинты получают бюджет запросов на IP и на tg_id. Проверка идет в
+# ASGI middleware до маршрутизации, поэтому отклоненный запрос не трогает БД и
+# не рисует капчу: клиент сразу получает 429 и заголовок Retry-After.
+# Ведро из burst жетонов пополняется со скоростью per_minute в минуту.
+# tg_id берется из пути (/api/user/{tg_id}) или из поля tg_id JSON-тела.
+#
+# Хранилище ведер (RATE_LIMIT_BACKEND):
+#   memory — в памяти процесса (по умолчанию; лимит на каждый воркер отдельно)
+#   redis  — общий Redis CACHE_REDIS_URL для всех воркеров (атомарный Lua-скрипт)
+#
+# Откуда брать IP клиента (RATE_LIMIT_CLIENT_IP):
+#   peer       — адрес соединения; только если backend открыт клиентам напрямую
+#   cloudflare — только заголовок CF-Connecting-IP (его выставляет Cloudflare,
+#                клиент подменить не может); схема vite /api + cloudflared
+#   forwarded  — X-Forwarded-For, запись, добавленная RATE_LIMIT_PROXY_HOPS-м
+#                доверенным прокси справа; левые записи присылает клиент
+# Пока источник не задан, лимитер выключен: за прокси все клиенты приходят
+# с 127.0.0.1 и делили бы одно ведро. См. .env.example.
+from collections import OrderedDict
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from typing import List, NamedTuple, Optional, Pattern
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+from backend.cache import CACHE_BACKEND, CACHE_REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_CLIENT_IP = os.getenv('RATE_LIMIT_CLIENT_IP', '').strip().lower()
+RATE_LIMIT_PROXY_HOPS = int(os.getenv('RATE_LIMIT_PROXY_HOPS', '1'))
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1' if RATE_LIMIT_CLIENT_IP else '0').strip() == '1'
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'redis' if CACHE_BACKEND == 'redis' else 'memory').strip().lower()
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+
+# тело длиннее не разбираем в поисках tg_id (лимит по IP при этом действует)
+_MAX_BODY_TO_PARSE = 64 * 1024
+
+
+class Budget(NamedTuple):
+    per_minute: float
+    burst: int
+
+
+class RateRule(NamedTuple):
+    name: str
+    method: str
+    path: Pattern
+    per_ip: Budget
+    per_user: Optional[Budget] = None
+
+
+RATE_RULES: List[RateRule] = [
+    RateRule("captcha", "GET", re.compile(r"^/api/captcha$"), per_ip=Budget(20, 10)),
+    RateRule("verify_captcha", "POST", re.compile(r"^/api/verify_captcha$"), per_ip=Budget(30, 10)),
+    RateRule("user_upsert", "POST", re.compile(r"^/api/user$"), per_ip=Budget(30, 15), per_user=Budget(10, 5)),
+    RateRule("user_get", "GET", re.compile(r"^/api/user/(?P<tg_id>\d+)$"), per_ip=Budget(120, 60), per_user=Budget(60, 30)),
+    RateRule("balance_create", "POST", re.compile(r"^/api/balance/create$"), per_ip=Budget(10, 5), per_user=Budget(5, 3)),
+]
+
+
+class MemoryRateLimitBackend:
+    """Ведра в памяти процесса; при переполнении вытесняются давно не тронутые"""
+
+    blocking = False
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, budget: Budget) -> float:
+        """Снимает жетон; возвращает 0 или через сколько секунд появится следующий"""
+        now = time.monotonic()
+        rate = budget.per_minute / 60.0
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(budget.burst), now))
+            tokens = min(float(budget.burst), tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0.0
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+_TAKE_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimitBackend:
+    """Общие ведра в Redis: чтение, пополнение и списание — один Lua-скрипт"""
+
+    blocking = True
+
+    def __init__(self, url: str = CACHE_REDIS_URL, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("RATE_LIMIT_BACKEND=redis требует пакет redis (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = "voidshop:ratelimit:"
+        self._take = client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key: str, budget: Budget) -> float:
+        result = self._take(keys=[self.prefix + key], args=[budget.burst, budget.per_minute / 60.0, time.time()])
+        return float(result)
+
+
+def create_rate_limit_backend(backend: str = RATE_LIMIT_BACKEND):
+    if backend == "redis":
+        return RedisRateLimitBackend()
+    if backend != "memory":
+        logger.warning(f"Неизвестный RATE_LIMIT_BACKEND={backend}, используется memory")
+    return MemoryRateLimitBackend()
+
+
+if RATE_LIMIT_ENABLED and RATE_LIMIT_CLIENT_IP not in ("peer", "cloudflare", "forwarded"):
+    logger.warning(f"RATE_LIMIT_CLIENT_IP={RATE_LIMIT_CLIENT_IP!r} не задан или неизвестен, используется адрес соединения")
+
+
+def _header_values(scope, name: bytes) -> List[str]:
+    return [v.decode("latin-1") for k, v in scope.get("headers", []) if k == name]
+
+
+def _client_ip(scope, source: str = RATE_LIMIT_CLIENT_IP, hops: int = RATE_LIMIT_PROXY_HOPS) -> str:
+    if source == "cloudflare":
+        values = _header_values(scope, b"cf-connecting-ip")
+        if values and values[-1].strip():
+            return values[-1].strip()
+    elif source == "forwarded":
+        # все заголовки X-Forwarded-For как один список; клиенту доверять нельзя,
+        # поэтому берем запись, которую добавил самый внешний доверенный прокси
+        chain = [ip.strip() for value in _header_values(scope, b"x-forwarded-for") for ip in value.split(",")]
+        chain = [ip for ip in chain if ip]
+        if hops > 0 and len(chain) >= hops:
+            return chain[-hops]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _tg_id_from_body(body: bytes) -> Optional[str]:
+    if not body or len(body) > _MAX_BODY_TO_PARSE:
+        return None
+    try:
+        tg_id = json.loads(body).get("tg_id")
+    except (ValueError, AttributeError):
+        return None
+    return str(int(tg_id)) if isinstance(tg_id, (int, str)) and str(tg_id).isdigit() else None
+
+
+def _replay_body(body: bytes, receive):
+    """receive, который сначала отдает уже прочитанное тело, затем — исходные события"""
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+
+class RateLimitMiddleware:
+    """ASGI middleware: 429 + Retry-After при исчерпании бюджета правила"""
+
+    def __init__(self, app, rules: List[RateRule] = RATE_RULES, backend=None):
+        self.app = app
+        self.rules = rules
+        self.backend = backend or create_rate_limit_backend()
+
+    def _match(self, scope) -> Optional[tuple]:
+        for rule in self.rules:
+            if scope["method"] == rule.method:
+                match = rule.path.match(scope["path"])
+                if match:
+                    return rule, match
+        return None
+
+    async def _take(self, key: str, budget: Budget) -> float:
+        try:
+            if self.backend.blocking:
+                return await run_in_threadpool(self.backend.take, key, budget)
+            return self.backend.take(key, budget)
+        except Exception as e:
+            # недоступное хранилище не должно класть API: пропускаем запрос
+            logger.warning(f"Лимит запросов не проверен: {e}")
+            return 0.0
+
+    async def __call__(self, scope, receive, send):
+        matched = self._match(scope) if scope["type"] == "http" else None
+        if matched is None:
+            return await self.app(scope, receive, send)
+        rule, match = matched
+
+        retry_after = await self._take(f"{rule.name}:ip:{_client_ip(scope)}", rule.per_ip)
+
+        if not retry_after and rule.per_user is not None:
+            tg_id = match.groupdict().get("tg_id")
+            if tg_id is None:
+                # читаем тело целиком и отдаем приложению его копию
+                chunks, more = [], True
+                while more:
+                    message = await receive()
+                    if message["type"] != "http.request":
+                        break
+                    chunks.append(message.get("body", b""))
+                    more = message.get("more_body", False)
+                body = b"".join(chunks)
+                tg_id = _tg_id_from_body(body)
+                receive = _replay_body(body, receive)
+            if tg_id is not None:
+                retry_after = await self._take(f"{rule.name}:tg:{tg_id}", rule.per_user)
+
+        if retry_after:
+            response = JSONResponse(
+                {"detail": "Слишком много запросов, попробуйте позже"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
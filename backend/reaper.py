@@ -0,0 +1,157 @@
+# backend/reaper.py - фоновая очистка устаревших строк
+# Раз в REAPER_INTERVAL секунд для каждого правила удаляются строки, чей срок
+# жизни истек, пакетами по REAPER_BATCH_SIZE строк — каждая пачка в своей
+# короткой транзакции, чтобы не держать блокировку записи SQLite. За один проход
+# правило удаляет не больше REAPER_MAX_BATCHES пачек, остальное — в следующий.
+# Правила:
+#   captcha_requests — CaptchaRequest с истекшим expires_at (брошенные капчи);
+#   stale_balance_requests — заявки в статусе pending без чека старше
+#     BALANCE_PENDING_TTL_HOURS часов (0 — не удалять).
+# Новое правило — ReapRule(название, модель, функция условия) в REAP_RULES.
+# Кроме строк удаляются файлы чеков без записи ReceiptFile (загрузка не
+# закоммитилась), не менявшиеся RECEIPT_ORPHAN_TTL_HOURS часов (0 — не удалять,
+# меньше RECEIPT_ORPHAN_MIN_HOURS не бывает). Загрузка пишет или "трогает"
+# файл до создания записи, поэтому файл идущей загрузки свежий и не подходит;
+# время изменения перепроверяется прямо перед удалением. Внутри процесса
+# проверка и удаление дополнительно идут под блокировкой записи в любом
+# профиле SQLite — как и коммит загрузки; между воркерами защищает только этот
+# запас по возрасту файла.
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, select
+from typing import Callable, Dict, List, NamedTuple
+import logging
+import os
+import time
+
+from backend import receipts
+from backend.buffered import PeriodicFlusher
+from backend.db import engine, write_guard
+from backend.models import CaptchaRequest, BalanceRequest
+
+logger = logging.getLogger(__name__)
+
+REAPER_INTERVAL = float(os.getenv('REAPER_INTERVAL', '300'))
+REAPER_BATCH_SIZE = int(os.getenv('REAPER_BATCH_SIZE', '500'))
+REAPER_MAX_BATCHES = int(os.getenv('REAPER_MAX_BATCHES', '20'))
+BALANCE_PENDING_TTL_HOURS = float(os.getenv('BALANCE_PENDING_TTL_HOURS', '72'))
+RECEIPT_ORPHAN_TTL_HOURS = float(os.getenv('RECEIPT_ORPHAN_TTL_HOURS', '24'))
+RECEIPT_ORPHAN_MIN_HOURS = 1.0
+
+
+def _utcnow() -> datetime:
+    # в SQLite даты хранятся без зоны (UTC)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ReapRule(NamedTuple):
+    name: str
+    model: type
+    # условие "строка устарела" на момент now; None — правило отключено
+    condition: Callable[[datetime], object]
+
+
+def _expired_captcha(now: datetime):
+    return CaptchaRequest.expires_at < now
+
+
+def _stale_pending_balance(now: datetime):
+    if BALANCE_PENDING_TTL_HOURS <= 0:
+        return None
+    return (
+        (BalanceRequest.status == 'pending')
+        & BalanceRequest.receipt_path.is_(None)
+        & (BalanceRequest.created_at < now - timedelta(hours=BALANCE_PENDING_TTL_HOURS))
+    )
+
+
+REAP_RULES: List[ReapRule] = [
+    ReapRule("captcha_requests", CaptchaRequest, _expired_captcha),
+    ReapRule("stale_balance_requests", BalanceRequest, _stale_pending_balance),
+]
+
+
+class Reaper(PeriodicFlusher):
+    name = "Очистка устаревших строк"
+
+    def __init__(self, rules: List[ReapRule] = REAP_RULES, interval: float = REAPER_INTERVAL,
+                 batch_size: int = REAPER_BATCH_SIZE, max_batches: int = REAPER_MAX_BATCHES,
+                 receipt_dir: str = receipts.UPLOAD_DIR, orphan_ttl_hours: float = RECEIPT_ORPHAN_TTL_HOURS):
+        super().__init__(interval)
+        self.rules = rules
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.receipt_dir = receipt_dir
+        self.orphan_ttl_hours = orphan_ttl_hours
+        self.removed: Dict[str, int] = {rule.name: 0 for rule in rules}
+        self.removed["orphan_receipts"] = 0
+
+    def reap(self, rule: ReapRule) -> int:
+        """Удаляет устаревшие строки одного правила, возвращает их число"""
+        condition = rule.condition(_utcnow())
+        if condition is None:
+            return 0
+        table = rule.model.__table__
+        pk = list(table.primary_key.columns)[0]
+        batch = delete(table).where(pk.in_(select(pk).where(condition).limit(self.batch_size)))
+        removed = 0
+        for _ in range(self.max_batches):
+            with write_guard(), engine.begin() as conn:
+                deleted = conn.execute(batch).rowcount
+            removed += deleted
+            if deleted < self.batch_size:
+                break
+        return removed
+
+    def reap_orphan_receipts(self) -> int:
+        """Удаляет давно не тронутые файлы чеков без записи ReceiptFile, возвращает их число"""
+        if self.orphan_ttl_hours <= 0:
+            return 0
+        cutoff = time.time() - max(self.orphan_ttl_hours, RECEIPT_ORPHAN_MIN_HOURS) * 3600
+        candidates = list(receipts.stale_files(self.receipt_dir, cutoff).items())
+        removed = 0
+        for start in range(0, len(candidates), self.batch_size):
+            batch = dict(candidates[start:start + self.batch_size])
+            with write_guard(always=True), engine.begin() as conn:
+                known = receipts.known_hashes(conn, batch)
+                for sha256, paths in batch.items():
+                    if sha256 in known:
+                        continue
+                    # загрузка того же чека обновляет время изменения файла
+                    if any(os.path.getmtime(path) >= cutoff for path in paths if os.path.exists(path)):
+                        continue
+                    for path in paths:
+                        try:
+                            os.remove(path)
+                        except FileNotFoundError:
+                            pass
+                    removed += 1
+        return removed
+
+    def flush(self) -> int:
+        total = 0
+        for rule in self.rules:
+            try:
+                removed = self.reap(rule)
+            except Exception as e:
+                logger.warning(f"{self.name}: {rule.name}: ошибка: {e}")
+                continue
+            if removed:
+                self.removed[rule.name] += removed
+                logger.info(f"{self.name}: {rule.name}: удалено строк: {removed}")
+            total += removed
+        try:
+            removed = self.reap_orphan_receipts()
+        except Exception as e:
+            logger.warning(f"{self.name}: orphan_receipts: ошибка: {e}")
+            removed = 0
+        if removed:
+            self.removed["orphan_receipts"] += removed
+            logger.info(f"{self.name}: orphan_receipts: удалено файлов: {removed}")
+        return total + removed
+
+    def stats(self) -> Dict[str, int]:
+        """Сколько строк (orphan_receipts — файлов) удалено с запуска процесса"""
+        return dict(self.removed)
+
+
+reaper = Reaper()
@@ -0,0 +1,132 @@
+# backend/receipt_images.py - превью и миниатюры чеков (Pillow, фоновый пул процессов)
+# После загрузки чека рядом с оригиналом в фоне создаются:
+#   <sha256>.preview.jpg — JPEG до PREVIEW_MAX_SIDE px, его бот отправляет админам
+#   <sha256>.thumb.webp  — WebP-миниатюра до THUMB_MAX_SIDE px
+# Ориентация из EXIF применяется, сами метаданные (EXIF, GPS) не копируются.
+# HEIC/HEIF читается через pillow-heif (есть в requirements); если пакет не
+# установлен, при старте пишется предупреждение, превью HEIC не строится и
+# админам уходит оригинал, который Telegram не показывает. PDF остаются без превью.
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+from typing import Optional
+import asyncio
+import logging
+import multiprocessing
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_IMAGE_WORKERS = int(os.getenv('RECEIPT_IMAGE_WORKERS', '2'))
+PREVIEW_MAX_SIDE = 1600
+PREVIEW_QUALITY = 80
+THUMB_MAX_SIDE = 320
+THUMB_QUALITY = 70
+
+RASTER_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+HEIF_EXTENSIONS = {'.heic', '.heif'}
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:
+    HEIF_SUPPORTED = False
+
+
+def preview_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".preview.jpg"
+
+
+def thumbnail_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".thumb.webp"
+
+
+def can_process(path: str) -> bool:
+    ext = os.path.splitext(path)[1].lower()
+    return ext in RASTER_EXTENSIONS or (ext in HEIF_EXTENSIONS and HEIF_SUPPORTED)
+
+
+def existing_preview(path: Optional[str]) -> Optional[str]:
+    """Путь к готовому превью или None"""
+    if not path:
+        return None
+    preview = preview_path(path)
+    return preview if os.path.exists(preview) else None
+
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def _save_atomic(img: Image.Image, path: str, fmt: str, **params):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        img.save(tmp_path, fmt, **params)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def make_derivatives(path: str) -> bool:
+    """Создает превью и миниатюру (выполняется в процессе пула)"""
+    if not can_process(path):
+        return False
+    if os.path.exists(preview_path(path)) and os.path.exists(thumbnail_path(path)):
+        return True  # тот же файл уже обработан (повторная загрузка)
+
+    with Image.open(path) as source:
+        img = _to_rgb(ImageOps.exif_transpose(source))
+
+    preview = img.copy()
+    preview.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE), Image.LANCZOS)
+    _save_atomic(preview, preview_path(path), "JPEG", quality=PREVIEW_QUALITY, optimize=True, progressive=True)
+
+    img.thumbnail((THUMB_MAX_SIDE, THUMB_MAX_SIDE), Image.LANCZOS)
+    _save_atomic(img, thumbnail_path(path), "WEBP", quality=THUMB_QUALITY, method=4)
+    return True
+
+
+class ReceiptImagePipeline:
+    def __init__(self, workers: int = RECEIPT_IMAGE_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        if not HEIF_SUPPORTED:
+            logger.warning("⚠️ pillow-heif не установлен: превью чеков HEIC/HEIF создаваться не будут "
+                           "(pip install pillow-heif)")
+        if self._pool is None and self.workers > 0:
+            # spawn: не наследуем потоки и соединения event loop'а
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def schedule(self, path: str) -> None:
+        """Ставит чек в очередь на обработку (не ждет результата)"""
+        if self._pool is None or not can_process(path):
+            return
+        # абсолютный путь: рабочий каталог процесса пула может отличаться
+        future = asyncio.get_running_loop().run_in_executor(self._pool, make_derivatives, os.path.abspath(path))
+        future.add_done_callback(lambda f: self._log_result(path, f))
+
+    @staticmethod
+    def _log_result(path: str, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error:
+            logger.warning(f"Не удалось создать превью чека {path}: {error}")
+
+    async def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+receipt_images = ReceiptImagePipeline()
@@ -0,0 +1,165 @@
+# backend/receipts.py - контентно-адресуемое хранилище чеков
+# Файл копируется кусками во временный файл (aiofiles, event loop не
+# блокируется), размер проверяется по ходу записи, SHA-256 считается на лету.
+# Итоговый путь определяется хешем: UPLOAD_DIR/ab/cd/<sha256><ext>, поэтому
+# повторная загрузка того же скриншота не занимает места, а в каталоге
+# не скапливаются сотни тысяч файлов. Готовый файл атомарно переименовывается,
+# недописанный чек никогда не виден по своему пути.
+# Запись ReceiptFile появляется вместе с первой заявкой, сославшейся на файл.
+# Заявки с чеком не удаляются (очистка трогает только pending без чека),
+# поэтому файл с записью хранится всегда. Файл без записи (загрузка не закоммитилась)
+# остается на месте: повторная загрузка того же чека его переиспользует, а
+# давно не тронутые такие файлы удаляет фоновая очистка (backend/reaper.py).
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import update, select
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import Dict, Iterable, List, NamedTuple, Optional
+import aiofiles
+import aiofiles.os
+import hashlib
+import logging
+import os
+import uuid
+
+from backend.models import ReceiptFile
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = "uploads/receipts"
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+_utime = aiofiles.os.wrap(os.utime)
+
+
+class StoredReceipt(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+    duplicate: bool
+
+
+class ReceiptMeta(NamedTuple):
+    """Что нужно для отдачи чека заявки (кешируется по order_id)"""
+    path: str
+    sha256: Optional[str]
+    mimetype: Optional[str]
+    filename: Optional[str]
+
+
+def receipt_path(directory: str, sha256: str, ext: str) -> str:
+    """Двухуровневый шардированный путь: ab/cd/abcd...<ext>"""
+    return os.path.join(directory, sha256[:2], sha256[2:4], f"{sha256}{ext}")
+
+
+async def _stream_to_temp(file: UploadFile, directory: str, max_size: int):
+    tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, 'wb') as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(status_code=400, detail="Файл слишком большой")
+                digest.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        await _remove_quietly(tmp_path)
+        raise
+    return tmp_path, size, digest.hexdigest()
+
+
+async def _remove_quietly(path: str):
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def store_upload(file: UploadFile, directory: str, ext: str, max_size: int) -> StoredReceipt:
+    """Потоково сохраняет загрузку в хранилище; дубликат не записывается повторно"""
+    tmp_path, size, sha256 = await _stream_to_temp(file, directory, max_size)
+    final_path = receipt_path(directory, sha256, ext)
+    try:
+        if await aiofiles.os.path.exists(final_path):
+            await _remove_quietly(tmp_path)
+            # свежее время изменения: очистка не примет файл за брошенный
+            await _utime(final_path)
+            return StoredReceipt(final_path, size, sha256, True)
+        await aiofiles.os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        await aiofiles.os.replace(tmp_path, final_path)
+    except BaseException:
+        await _remove_quietly(tmp_path)
+        raise
+    return StoredReceipt(final_path, size, sha256, False)
+
+
+def _insert(conn):
+    return (postgresql if conn.dialect.name == 'postgresql' else sqlite).insert(ReceiptFile)
+
+
+def register(conn, stored_sha256: str, path: str, size: int) -> str:
+    """Учитывает файл в ReceiptFile (запись создается при первой загрузке)
+
+    Возвращает путь, под которым файл уже учтен: тот же чек с другим
+    расширением ссылается на первый файл, а копию по path можно удалить.
+    """
+    stmt = _insert(conn).values(sha256=stored_sha256, path=path, size=size)
+    conn.execute(stmt.on_conflict_do_nothing(index_elements=[ReceiptFile.sha256]))
+    return conn.execute(select(ReceiptFile.path).where(ReceiptFile.sha256 == stored_sha256)).scalar_one()
+
+
+def stale_files(directory: str, older_than: float) -> Dict[str, List[str]]:
+    """Файлы хранилища, не менявшиеся с момента older_than: {sha256: [оригинал, превью...]}"""
+    groups: Dict[str, List[str]] = {}
+    fresh = set()
+    for first in os.scandir(directory) if os.path.isdir(directory) else ():
+        if not (first.is_dir() and len(first.name) == 2):
+            continue
+        for second in os.scandir(first.path):
+            if not second.is_dir():
+                continue
+            for entry in os.scandir(second.path):
+                sha256 = entry.name.split(".", 1)[0]
+                if len(sha256) != 64 or not entry.is_file():
+                    continue
+                if entry.stat().st_mtime >= older_than:
+                    fresh.add(sha256)
+                groups.setdefault(sha256, []).append(entry.path)
+    return {sha256: paths for sha256, paths in groups.items() if sha256 not in fresh}
+
+
+def known_hashes(conn, hashes: Iterable[str]) -> set:
+    hashes = list(set(hashes))
+    if not hashes:
+        return set()
+    return set(conn.execute(select(ReceiptFile.sha256).where(ReceiptFile.sha256.in_(hashes))).scalars())
+
+
+def telegram_file_ids(conn, hashes: Iterable[str]) -> Dict[str, str]:
+    hashes = [h for h in set(hashes) if h]
+    if not hashes:
+        return {}
+    rows = conn.execute(
+        select(ReceiptFile.sha256, ReceiptFile.telegram_file_id)
+        .where(ReceiptFile.sha256.in_(hashes), ReceiptFile.telegram_file_id.is_not(None))
+    )
+    return {sha256: file_id for sha256, file_id in rows}
+
+
+def set_telegram_file_id(conn, sha256: str, file_id: str) -> bool:
+    result = conn.execute(
+        update(ReceiptFile).where(ReceiptFile.sha256 == sha256).values(telegram_file_id=file_id)
+    )
+    return result.rowcount > 0
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,13 +1,22 @@
 # backend/routes/balance.py - ИСПРАВЛЕНО: включаем крипто-метод по умолчанию
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Header, Request, Response
+from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field, validator
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
-from backend.db import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from backend.db import get_session, get_async_session, write_session, write_guard, async_write_guard
 from backend.models import User, BalanceRequest, SystemSettings, ReferralStats
+from backend.settings import system_settings, PaymentSettings
+from backend.ids import generate_order_id
+from backend import receipts
+from backend.receipt_images import receipt_images, existing_preview, preview_path, thumbnail_path, can_process
+from backend import versions
+from backend.cache import receipt_cache, make_key
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import List, Literal, Optional
+import hmac
 import logging
-import time
 import random
 import os
 import json
@@ -16,8 +25,10 @@ router = APIRouter(prefix='/api/balance')
 logger = logging.getLogger(__name__)
 
 # Настройки файлов
-UPLOAD_DIR = "uploads/receipts"
+UPLOAD_DIR = receipts.UPLOAD_DIR
 MAX_FILE_SIZE = 25 * 1024 * 1024  # 25MB
+RECEIPT_MAX_AGE = 365 * 24 * 3600  # чеки по хешу неизменяемы
+ORDER_ID_ATTEMPTS = 3  # повторы при совпадении ID заявки
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.pdf', '.webp', '.heic', '.heif'}
 ALLOWED_MIMETYPES = {
     'image/jpeg', 'image/jpg', 'image/png', 'image/webp',
@@ -25,6 +36,9 @@ ALLOWED_MIMETYPES = {
     'application/pdf'
 }
 
+# Общий секрет бота для служебных эндпоинтов (заголовок X-Bot-Secret); пусто — они отключены
+BOT_API_SECRET = os.getenv('BOT_API_SECRET', '')
+
 # Создаем директорию если не существует
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
@@ -75,16 +89,12 @@ class BalanceRequestOut(BaseModel):
     user_username: Optional[str]
     admin_comment: Optional[str]
     receipt_path: Optional[str]
+    receipt_sha256: Optional[str] = None
+    receipt_telegram_file_id: Optional[str] = None
+    receipt_preview_path: Optional[str] = None
     receipt_filename: Optional[str]
 
 
-def generate_order_id() -> str:
-    """Генерирует уникальный ID заявки"""
-    timestamp = int(time.time() * 1000)
-    random_part = random.randint(100, 999)
-    return f"VB{timestamp}{random_part}"
-
-
 def validate_file(file: UploadFile) -> tuple[bool, str]:
     """Валидация загружаемого файла"""
     if not file.filename:
@@ -107,86 +117,42 @@ def validate_file(file: UploadFile) -> tuple[bool, str]:
 
 
 def get_payment_details_from_settings(method: str, amount: float):
-    """Получает реквизиты из настроек базы данных"""
-    with get_session() as session:
-        try:
-            if method == 'card':
-                # Получаем реквизиты карты из настроек
-                card_number = session.exec(
-                    select(SystemSettings).where(SystemSettings.key == "payment_card_number")
-                ).first()
-                card_holder = session.exec(
-                    select(SystemSettings).where(SystemSettings.key == "payment_card_holder")
-                ).first()
-                bank_name = session.exec(
-                    select(SystemSettings).where(SystemSettings.key == "payment_bank_name")
-                ).first()
-
-                return {
-                    "type": "card",
-                    "card_number": card_number.value if card_number else "5536 9141 2345 6789",
-                    "card_holder": card_holder.value if card_holder else "VOID SHOP",
-                    "bank": bank_name.value if bank_name else "Сбер Банк",
-                    "amount": amount,
-                    "instructions": [
-                        f"Переведите точную сумму ₽{amount:,.2f} на карту",
-                        "Сделайте скриншот чека об оплате",
-                        "Загрузите чек в приложении",
-                        "Нажмите 'Я оплатил'",
-                        "Ожидайте подтверждения (5-15 минут)"
-                    ]
-                }
-            elif method == 'crypto':
-                btc_wallet = session.exec(
-                    select(SystemSettings).where(SystemSettings.key == "payment_btc_wallet")
-                ).first()
-                usdt_wallet = session.exec(
-                    select(SystemSettings).where(SystemSettings.key == "payment_usdt_wallet")
-                ).first()
+    """Получает реквизиты из настроек базы данных (одним запросом, через кеш)"""
+    try:
+        payment = system_settings.payment()
+    except Exception as e:
+        logger.error(f"Ошибка получения реквизитов: {e}")
+        # Fallback реквизиты
+        payment = PaymentSettings()
 
-                return {
-                    "type": "crypto",
-                    "wallet_btc": btc_wallet.value if btc_wallet else "bc1qxy2kgdygjrsqtzq2n0yrf2493p83kkfjhx0wlh",
-                    "wallet_usdt": usdt_wallet.value if usdt_wallet else "TQRRm4Pg5wKTZJhP5QiCEkT3JzRzJ3qS4F",
-                    "amount": amount,
-                    "instructions": [
-                        f"Отправьте криптовалюту эквивалентную ₽{amount:,.2f}",
-                        "Сделайте скриншот транзакции",
-                        "Загрузите скриншот в приложении",
-                        "Нажмите 'Я оплатил'"
-                    ]
-                }
-        except Exception as e:
-            logger.error(f"Ошибка получения реквизитов: {e}")
-            # Fallback реквизиты
-            if method == 'card':
-                return {
-                    "type": "card",
-                    "card_number": "5536 9141 2345 6789",
-                    "card_holder": "VOID SHOP",
-                    "bank": "Сбер Банк",
-                    "amount": amount,
-                    "instructions": [
-                        f"Переведите точную сумму ₽{amount:,.2f} на карту",
-                        "Сделайте скриншот чека об оплате",
-                        "Загрузите чек в приложении",
-                        "Нажмите 'Я оплатил'",
-                        "Ожидайте подтверждения (5-15 минут)"
-                    ]
-                }
-            else:
-                return {
-                    "type": "crypto",
-                    "wallet_btc": "bc1qxy2kgdygjrsqtzq2n0yrf2493p83kkfjhx0wlh",
-                    "wallet_usdt": "TQRRm4Pg5wKTZJhP5QiCEkT3JzRzJ3qS4F",
-                    "amount": amount,
-                    "instructions": [
-                        f"Отправьте криптовалюту эквивалентную ₽{amount:,.2f}",
-                        "Сделайте скриншот транзакции",
-                        "Загрузите скриншот в приложении",
-                        "Нажмите 'Я оплатил'"
-                    ]
-                }
+    if method == 'card':
+        return {
+            "type": "card",
+            "card_number": payment.card_number,
+            "card_holder": payment.card_holder,
+            "bank": payment.bank_name,
+            "amount": amount,
+            "instructions": [
+                f"Переведите точную сумму ₽{amount:,.2f} на карту",
+                "Сделайте скриншот чека об оплате",
+                "Загрузите чек в приложении",
+                "Нажмите 'Я оплатил'",
+                "Ожидайте подтверждения (5-15 минут)"
+            ]
+        }
+    elif method == 'crypto':
+        return {
+            "type": "crypto",
+            "wallet_btc": payment.btc_wallet,
+            "wallet_usdt": payment.usdt_wallet,
+            "amount": amount,
+            "instructions": [
+                f"Отправьте криптовалюту эквивалентную ₽{amount:,.2f}",
+                "Сделайте скриншот транзакции",
+                "Загрузите скриншот в приложении",
+                "Нажмите 'Я оплатил'"
+            ]
+        }
 
 
 @router.post('/create', response_model=dict)
@@ -194,7 +160,7 @@ def create_balance_request(data: CreateBalanceRequestIn):
     """Создание заявки на пополнение"""
     logger.info(f"💳 Создание заявки: tg_id={data.tg_id}, amount={data.amount}, method={data.method}")
 
-    with get_session() as session:
+    with write_session() as session:
         try:
             # Находим пользователя
             user = session.exec(
@@ -204,35 +170,33 @@ def create_balance_request(data: CreateBalanceRequestIn):
             if not user:
                 raise HTTPException(status_code=404, detail='Пользователь не найден')
 
-            # Генерируем уникальный order_id
-            order_id = None
-            for _ in range(10):
-                potential_id = generate_order_id()
-                existing = session.exec(
-                    select(BalanceRequest).where(BalanceRequest.order_id == potential_id)
-                ).first()
-                if not existing:
-                    order_id = potential_id
-                    break
-
-            if not order_id:
-                raise HTTPException(status_code=500, detail='Не удалось сгенерировать ID')
-
-            # Создаем заявку
-            balance_request = BalanceRequest(
-                order_id=order_id,
-                user_id=user.id,
-                tg_id=data.tg_id,
-                amount=data.amount,
-                method=data.method,
-                status='pending',
-                user_name=f"{user.first_name or ''} {user.last_name or ''}".strip() or user.username or 'Пользователь',
-                user_username=user.username,
-                created_at=datetime.now(timezone.utc)
-            )
+            # ID уникален без проверки в БД (backend/ids.py); совпадение номеров воркеров
+            # без ORDER_ID_WORKER дает IntegrityError — тогда берем следующий ID
+            for attempt in range(ORDER_ID_ATTEMPTS):
+                order_id = generate_order_id()
+
+                # Создаем заявку
+                balance_request = BalanceRequest(
+                    order_id=order_id,
+                    user_id=user.id,
+                    tg_id=data.tg_id,
+                    amount=data.amount,
+                    method=data.method,
+                    status='pending',
+                    user_name=f"{user.first_name or ''} {user.last_name or ''}".strip() or user.username or 'Пользователь',
+                    user_username=user.username,
+                    created_at=datetime.now(timezone.utc)
+                )
 
-            session.add(balance_request)
-            session.commit()
+                session.add(balance_request)
+                try:
+                    session.commit()
+                    break
+                except IntegrityError:
+                    session.rollback()
+                    if attempt + 1 == ORDER_ID_ATTEMPTS:
+                        raise
+                    logger.warning(f"⚠️ ID заявки {order_id} уже занят, повтор")
             session.refresh(balance_request)
 
             # Получаем реквизиты для оплаты
@@ -268,16 +232,16 @@ def create_balance_request(data: CreateBalanceRequestIn):
 async def upload_receipt(
         order_id: str,
         file: UploadFile = File(...),
-        session=Depends(get_session)
+        session: AsyncSession = Depends(get_async_session)
 ):
     """Загрузка чека к заявке"""
     logger.info(f"📎 Загрузка чека для заявки {order_id}: {file.filename}")
 
     try:
         # Находим заявку
-        balance_request = session.exec(
+        balance_request = (await session.exec(
             select(BalanceRequest).where(BalanceRequest.order_id == order_id)
-        ).first()
+        )).first()
 
         if not balance_request:
             raise HTTPException(status_code=404, detail='Заявка не найдена')
@@ -290,30 +254,43 @@ async def upload_receipt(
         if not is_valid:
             raise HTTPException(status_code=400, detail=error_msg)
 
-        # Читаем файл
-        content = await file.read()
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail="Файл слишком большой")
-
-        # Генерируем имя файла
+        # Сохраняем файл потоково в хранилище по хешу: повторная загрузка того же файла не занимает места
         file_ext = os.path.splitext(file.filename)[1].lower()
-        safe_filename = f"{order_id}_{int(time.time())}{file_ext}"
-        file_path = os.path.join(UPLOAD_DIR, safe_filename)
-
-        # Сохраняем файл
-        with open(file_path, 'wb') as f:
-            f.write(content)
+        saved = await receipts.store_upload(file, UPLOAD_DIR, file_ext, MAX_FILE_SIZE)
 
         # Обновляем заявку
-        balance_request.receipt_path = file_path
         balance_request.receipt_filename = file.filename
         balance_request.receipt_mimetype = file.content_type
-        balance_request.receipt_size = len(content)
+        balance_request.receipt_size = saved.size
+        balance_request.receipt_sha256 = saved.sha256
         balance_request.status = 'receipt_uploaded'
         balance_request.uploaded_at = datetime.now(timezone.utc)
 
-        session.add(balance_request)
-        session.commit()
+        try:
+            # блокировка в любом профиле: очистка проверяет и удаляет файлы без записи под ней
+            # же (только в пределах процесса; между воркерами — запас по возрасту файла)
+            async with async_write_guard(always=True):
+                session.add(balance_request)
+                file_path = await session.run_sync(
+                    lambda sync_session: receipts.register(sync_session.connection(), saved.sha256, saved.path, saved.size)
+                )
+                if not os.path.exists(file_path):
+                    # файл без записи успела удалить очистка
+                    raise HTTPException(status_code=409, detail='Чек не сохранен, загрузите его еще раз')
+                balance_request.receipt_path = file_path
+                await session.commit()
+        except Exception:
+            # файл не удаляем: его может уже использовать параллельная загрузка того же
+            # чека; файл без записи ReceiptFile удалит фоновая очистка
+            await session.rollback()
+            raise
+
+        if file_path != saved.path and not saved.duplicate:
+            # тот же чек уже хранится с другим расширением — копия не нужна
+            os.remove(saved.path)
+
+        # Превью и миниатюра создаются в фоне, ответ их не ждет
+        receipt_images.schedule(file_path)
 
         logger.info(f"✅ Чек сохранен: {file_path}")
 
@@ -338,7 +315,7 @@ def mark_paid(order_id: str):
     """Отметка об оплате - готово к проверке админом"""
     logger.info(f"💰 Отметка об оплате: {order_id}")
 
-    with get_session() as session:
+    with write_session() as session:
         try:
             balance_request = session.exec(
                 select(BalanceRequest).where(BalanceRequest.order_id == order_id)
@@ -382,7 +359,7 @@ def process_balance_request(order_id: str, data: ProcessBalanceRequestIn):
     """Обработка заявки администратором"""
     logger.info(f"🔧 Админ обработка {order_id}: {data.action}")
 
-    with get_session() as session:
+    with write_session() as session:
         try:
             balance_request = session.exec(
                 select(BalanceRequest).where(BalanceRequest.order_id == order_id)
@@ -496,7 +473,16 @@ def get_user_balance_requests(tg_id: int):
                 .order_by(BalanceRequest.created_at.desc())
             ).all()
 
-            return list(requests)
+            # file_id чека, уже загруженного в Telegram: бот отправит его без повторной загрузки
+            file_ids = receipts.telegram_file_ids(session.connection(), (r.receipt_sha256 for r in requests))
+            return [
+                BalanceRequestOut.model_validate(r, from_attributes=True).model_copy(
+                    update={
+                        "receipt_telegram_file_id": file_ids.get(r.receipt_sha256),
+                        "receipt_preview_path": existing_preview(r.receipt_path),
+                    }
+                ) for r in requests
+            ]
 
         except Exception as e:
             logger.error(f"Ошибка загрузки заявок: {e}")
@@ -504,10 +490,16 @@ def get_user_balance_requests(tg_id: int):
 
 
 @router.get('/methods', response_model=List[dict])
-def get_payment_methods():
+def get_payment_methods(request: Request, response: Response):
     """Доступные способы пополнения"""
     logger.info("📋 Запрос методов пополнения")
 
+    with get_session() as session:
+        table_versions = versions.get_versions(session, ("system_settings",))
+    unchanged = versions.not_modified(request, response, table_versions)
+    if unchanged:
+        return unchanged
+
     methods = [
         {
             "id": "card",
@@ -537,30 +529,101 @@ def get_payment_methods():
     return methods
 
 
-@router.get('/receipt/{order_id}')
-async def get_receipt(order_id: str):
-    """Получение файла чека"""
-    from fastapi.responses import FileResponse
-
-    with get_session() as session:
-        balance_request = session.exec(
-            select(BalanceRequest).where(BalanceRequest.order_id == order_id)
-        ).first()
+async def _receipt_meta(session: AsyncSession, order_id: str) -> receipts.ReceiptMeta:
+    """Метаданные чека заявки; повторные открытия не обращаются к БД"""
+    key = make_key("receipt", order_id=order_id)
+    meta = receipt_cache.get(key)
+    if meta is not None:
+        return meta
+
+    row = (await session.exec(
+        select(
+            BalanceRequest.receipt_path, BalanceRequest.receipt_sha256,
+            BalanceRequest.receipt_mimetype, BalanceRequest.receipt_filename,
+        ).where(BalanceRequest.order_id == order_id)
+    )).first()
+
+    if not row:
+        raise HTTPException(status_code=404, detail='Заявка не найдена')
+
+    if not row.receipt_path:
+        raise HTTPException(status_code=404, detail='Чек не найден')
+
+    # кешируем только загруженный чек: после загрузки он у заявки не меняется
+    meta = receipts.ReceiptMeta(*row)
+    receipt_cache.set(key, meta)
+    return meta
+
+
+def _receipt_variant(meta: receipts.ReceiptMeta, variant: str):
+    """(вариант, путь, stat, media_type, имя файла) для отдачи; без готового превью — оригинал"""
+    base_name = os.path.splitext(meta.filename or 'receipt')[0]
+    derived = {
+        'preview': (preview_path(meta.path), 'image/jpeg', f"{base_name}.jpg"),
+        'thumb': (thumbnail_path(meta.path), 'image/webp', f"{base_name}.webp"),
+    }
+    if variant in derived:
+        path, media_type, filename = derived[variant]
+        try:
+            return variant, path, os.stat(path), media_type, filename
+        except FileNotFoundError:
+            pass
 
-        if not balance_request:
-            raise HTTPException(status_code=404, detail='Заявка не найдена')
+    try:
+        stat_result = os.stat(meta.path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail='Файл чека не найден')
+    return 'original', meta.path, stat_result, meta.mimetype or 'application/octet-stream', meta.filename or 'receipt'
 
-        if not balance_request.receipt_path:
-            raise HTTPException(status_code=404, detail='Чек не найден')
 
-        if not os.path.exists(balance_request.receipt_path):
+@router.get('/receipt/{order_id}')
+async def get_receipt(
+        order_id: str,
+        request: Request,
+        variant: Literal['preview', 'thumb', 'original'] = 'preview',
+        session: AsyncSession = Depends(get_async_session)
+):
+    """Получение файла чека (по умолчанию сжатое превью, если оно уже готово)
+
+    FileResponse отдает файл кусками (или через sendfile, если сервер поддерживает
+    расширение http.response.pathsend) и обрабатывает Range / If-Range.
+    """
+    meta = await _receipt_meta(session, order_id)
+    served, path, stat_result, media_type, filename = _receipt_variant(meta, variant)
+
+    headers = {}
+    if meta.sha256:
+        # Файлы лежат по хешу содержимого и не меняются. Пока превью не готово,
+        # вместо него отдается оригинал — такой ответ кешировать нельзя
+        final = served == variant or not can_process(meta.path)
+        headers["ETag"] = f'"{meta.sha256}-{served}"'
+        headers["Cache-Control"] = f"private, max-age={RECEIPT_MAX_AGE}, immutable" if final else "private, no-cache"
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and versions.etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+    return FileResponse(path, headers=headers, media_type=media_type, filename=filename, stat_result=stat_result)
+
+
+def require_bot_secret(x_bot_secret: Optional[str] = Header(default=None)):
+    """Пускает только бота: file_id уходит админам, подменять его клиентам нельзя"""
+    if not BOT_API_SECRET or not x_bot_secret or not hmac.compare_digest(x_bot_secret, BOT_API_SECRET):
+        raise HTTPException(status_code=403, detail='Доступ только для бота')
+
+
+@router.put('/receipt-file/{sha256}/telegram', response_model=dict, dependencies=[Depends(require_bot_secret)])
+def set_receipt_telegram_file_id(sha256: str, data: dict):
+    """Запоминает file_id чека в Telegram (вызывает бот после первой отправки)"""
+    file_id = data.get('file_id')
+    if not file_id or not isinstance(file_id, str):
+        raise HTTPException(status_code=400, detail='Не указан file_id')
+
+    with write_session() as session:
+        if not receipts.set_telegram_file_id(session.connection(), sha256, file_id):
             raise HTTPException(status_code=404, detail='Файл чека не найден')
+        session.commit()
 
-        return FileResponse(
-            balance_request.receipt_path,
-            media_type=balance_request.receipt_mimetype or 'application/octet-stream',
-            filename=balance_request.receipt_filename or 'receipt'
-        )
+    return {"success": True}
 
 
 @router.get('/referral/stats/{tg_id}')
@@ -579,8 +642,9 @@ def get_referral_stats(tg_id: int):
             # Генерируем реферальный код если его нет
             if not user.referral_code:
                 user.referral_code = f"REF{user.id}{random.randint(100, 999)}"
-                session.add(user)
-                session.commit()
+                with write_guard():
+                    session.add(user)
+                    session.commit()
                 session.refresh(user)
 
             # Получаем статистику по рефералам
@@ -666,7 +730,7 @@ def init_default_payment_settings():
         }
     ]
 
-    with get_session() as session:
+    with write_session() as session:
         for setting_data in default_settings:
             existing = session.exec(
                 select(SystemSettings).where(SystemSettings.key == setting_data["key"])
@@ -1,14 +1,22 @@
 ﻿# backend/routes/captcha.py
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, HTTPException, Response, Depends
 from pydantic import BaseModel
 from datetime import datetime, timedelta, timezone
-import random, string, io, base64, hashlib, traceback, json, os, math
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+import random, string, io, base64, hashlib, traceback, json, os, math, logging
+from PIL import Image, ImageDraw, ImageFilter
 from sqlmodel import select
-from backend.db import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from backend.db import get_async_session, async_write_guard
 from backend.models import CaptchaRequest
+from backend.captcha_pool import CaptchaPool
+from backend.captcha_glyphs import glyph_atlas
+from backend import captcha_tokens
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter(prefix="/api")
+logger = logging.getLogger(__name__)
+# pillow — generate_captcha_image ниже; numpy — backend/captcha_numpy.py (нужен numpy)
+CAPTCHA_RENDERER = os.getenv('CAPTCHA_RENDERER', 'pillow').strip().lower()
 CAPTCHA_CHARS = string.ascii_uppercase + "23456789"
 CAPTCHA_LEN = 5
 
@@ -18,36 +26,6 @@ def hash_answer(s: str) -> str:
 def random_text(n=CAPTCHA_LEN):
     return "".join(random.choice(CAPTCHA_CHARS) for _ in range(n))
 
-def _measure_text(draw, font, text):
-    if hasattr(font, "getbbox"):
-        bbox = font.getbbox(text)
-        return bbox[2] - bbox[0], bbox[3] - bbox[1]
-    if hasattr(draw, "textbbox"):
-        bbox = draw.textbbox((0,0), text, font=font)
-        return bbox[2] - bbox[0], bbox[3] - bbox[1]
-    if hasattr(font, "getsize"):
-        return font.getsize(text)
-    return (len(text) * 12, 24)
-
-def _load_font(preferred_size: int):
-    candidates = [
-        "arial.ttf",
-        "DejaVuSans.ttf",
-        "DejaVuSans-Bold.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
-    ]
-    for p in candidates:
-        try:
-            if os.path.exists(p):
-                return ImageFont.truetype(p, preferred_size)
-            else:
-                # Pillow may find some fonts by name
-                return ImageFont.truetype(p, preferred_size)
-        except Exception:
-            continue
-    return ImageFont.load_default()
-
 def _draw_quadratic_curve(draw, start, control, end, width=2, fill=(0,0,0,80)):
     # sample many points along a quadratic bezier and draw lines between them
     pts = []
@@ -65,9 +43,6 @@ def generate_captcha_image(text: str, size=(420,140)):
     image = Image.new("RGB", (w, h), (250, 250, 250))
     draw = ImageDraw.Draw(image)
 
-    # attempt to get a decent font
-    font = _load_font(64)
-
     # light vertical banding background for texture
     for i in range(0, w, 8):
         col = 248 - ((i//8) % 6)
@@ -96,11 +71,11 @@ def generate_captcha_image(text: str, size=(420,140)):
         base_gray = 18 + random.randint(0,40)
         fill = (base_gray, base_gray + random.randint(0,10), base_gray + random.randint(0,10), 255)
 
-        # draw the character roughly centered in the char_img
-        tw, th = _measure_text(cd, font, ch)
-        cx = (char_w - tw) // 2 + random.randint(-6,6)
-        cy = (char_h - th) // 2 + random.randint(-8,8)
-        cd.text((cx, cy), ch, font=font, fill=fill)
+        # blit the pre-rasterized glyph roughly centered in the char_img
+        mask = glyph_atlas.get(ch, random.choice(glyph_atlas.weights))
+        cx = (char_w - mask.width) // 2 + random.randint(-6,6)
+        cy = (char_h - mask.height) // 2 + random.randint(-8,8)
+        char_img.paste(fill, (cx, cy, cx + mask.width, cy + mask.height), mask)
 
         # draw a couple of small strokes over the character to add texture
         for _ in range(2):
@@ -164,27 +139,54 @@ def generate_captcha_image(text: str, size=(420,140)):
 
     return image
 
+_renderer = None
+
+def _get_renderer():
+    global _renderer
+    if _renderer is None:
+        _renderer = generate_captcha_image
+        if CAPTCHA_RENDERER == 'numpy':
+            try:
+                from backend.captcha_numpy import generate_captcha_image_numpy
+                _renderer = generate_captcha_image_numpy
+            except ImportError as e:
+                logger.warning(f"CAPTCHA_RENDERER=numpy недоступен ({e}), используется pillow")
+    return _renderer
+
+def render_captcha():
+    """Новая капча: (hash ответа, PNG в data URL). Выполняется в процессах пула"""
+    text = random_text()
+    img = _get_renderer()(text)
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    b64 = base64.b64encode(buf.getvalue()).decode()
+    return hash_answer(text), f'data:image/png;base64,{b64}'
+
+def prebuild_glyphs():
+    """Атлас символов (и шрифт) — при старте процесса, а не на первой капче"""
+    glyph_atlas.prebuild(CAPTCHA_CHARS)
+
+# запускается и останавливается в backend/app.py
+captcha_pool = CaptchaPool(render_captcha, initializer=prebuild_glyphs)
+
 class CaptchaOut(BaseModel):
     token: str
     image: str
 
 @router.get('/captcha', response_model=CaptchaOut)
-def get_captcha():
+async def get_captcha(session: AsyncSession = Depends(get_async_session)):
     try:
-        text = random_text()
-        img = generate_captcha_image(text)
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        b64 = base64.b64encode(buf.getvalue()).decode()
-        data_url = f'data:image/png;base64,{b64}'
-
-        hashed = hash_answer(text)
+        hashed, data_url = await captcha_pool.get()
+
+        if captcha_tokens.CAPTCHA_MODE == 'stateless':
+            # подписанный токен вместо строки CaptchaRequest: БД не трогаем
+            return {'token': captcha_tokens.issue(hashed), 'image': data_url}
+
         cr = CaptchaRequest(answer_hash=hashed, expires_at=datetime.now(timezone.utc) + timedelta(minutes=6))
-        with get_session() as session:
+        token = cr.token
+        async with async_write_guard():
             session.add(cr)
-            session.commit()
-            session.refresh(cr)
-            token = cr.token
+            await session.commit()
 
         return {'token': token, 'image': data_url}
     except Exception as e:
@@ -194,6 +196,11 @@ def get_captcha():
         payload = {"ok": False, "error": str(e), "traceback": tb}
         return Response(content=json.dumps(payload, ensure_ascii=False), media_type="application/json", status_code=500)
 
+@router.get('/captcha/pool/stats')
+def get_captcha_pool_stats():
+    """Заполненность пула капч, число запросов, не заставших готовую картинку, и атлас символов"""
+    return {**captcha_pool.stats(), "glyph_atlas": glyph_atlas.stats()}
+
 class VerifyIn(BaseModel):
     token: str
     answer: str
@@ -203,20 +210,26 @@ class VerifyOut(BaseModel):
     reason: str | None = None
 
 @router.post('/verify_captcha', response_model=VerifyOut)
-def verify_captcha(data: VerifyIn):
-    with get_session() as session:
-        stmt = select(CaptchaRequest).where(CaptchaRequest.token == data.token)
-        res = session.exec(stmt).first()
-        if not res:
+async def verify_captcha(data: VerifyIn, session: AsyncSession = Depends(get_async_session)):
+    if captcha_tokens.is_stateless_token(data.token):
+        # проверка nonce в общем хранилище (sqlite / redis) блокирующая — в пул потоков
+        result = await run_in_threadpool(captcha_tokens.verify, data.token, hash_answer(data.answer))
+        if result in (captcha_tokens.INVALID, captcha_tokens.USED):
             raise HTTPException(status_code=400, detail='token not found or expired')
-        if res.is_expired():
-            session.delete(res)
-            session.commit()
-            return {'ok': False, 'reason': 'expired'}
-        if res.answer_hash != hash_answer(data.answer):
-            session.delete(res)
-            session.commit()
-            return {'ok': False, 'reason': 'wrong'}
-        session.delete(res)
-        session.commit()
+        if result != captcha_tokens.OK:
+            return {'ok': False, 'reason': result}
         return {'ok': True, 'reason': None}
+
+    stmt = select(CaptchaRequest).where(CaptchaRequest.token == data.token)
+    res = (await session.exec(stmt)).first()
+    if not res:
+        raise HTTPException(status_code=400, detail='token not found or expired')
+    # токен одноразовый: удаляем его при любом исходе проверки
+    async with async_write_guard():
+        await session.delete(res)
+        await session.commit()
+    if res.is_expired():
+        return {'ok': False, 'reason': 'expired'}
+    if res.answer_hash != hash_answer(data.answer):
+        return {'ok': False, 'reason': 'wrong'}
+    return {'ok': True, 'reason': None}
\ No newline at end of file
@@ -1,12 +1,20 @@
 # backend/routes/store.py - ИСПРАВЛЕННАЯ ВЕРСИЯ БЕЗ БАГОВ
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Depends, Request, Response
 from pydantic import BaseModel
 from sqlmodel import select
-from backend.db import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from backend.db import get_async_session
 from backend.models import Store, Product, Category, StoreStatus, ProductStatus
+from backend import counters  # noqa: F401 — обработчики счетчиков products_count
+from backend import search as search_index
+from backend import versions
+from backend.pagination import Keyset, set_next_cursor
+from backend.view_counter import view_counter
+from backend.cache import catalog_cache, settings_cache, receipt_cache, make_key
 from datetime import datetime
 from typing import List, Optional
 import logging
+import time
 
 router = APIRouter(prefix='/api/stores')
 logger = logging.getLogger(__name__)
@@ -64,324 +72,356 @@ class CategoryOut(BaseModel):
 
 
 @router.get('', response_model=List[StoreOut])
-def get_stores(
+async def get_stores(
+        request: Request,
+        response: Response,
         city: Optional[str] = Query(default="Москва", description="Город"),
         featured: Optional[bool] = Query(default=None, description="Только рекомендуемые"),
         category: Optional[str] = Query(default=None, description="Категория товаров"),
         search: Optional[str] = Query(default=None, description="Поиск по названию"),
         limit: int = Query(default=20, le=100, description="Количество результатов"),
-        offset: int = Query(default=0, description="Смещение")
+        offset: int = Query(default=0, description="Смещение (устарело, используйте cursor)"),
+        cursor: Optional[str] = Query(default=None, description="Курсор из заголовка X-Next-Cursor"),
+        session: AsyncSession = Depends(get_async_session)
 ):
     """Получает список магазинов с фильтрацией"""
 
     logger.info(f"Запрос магазинов: city={city}, featured={featured}, search={search}")
 
-    with get_session() as session:
-        # Базовый запрос только активных магазинов
-        stmt = select(Store).where(Store.status == StoreStatus.ACTIVE)
-
-        # Показываем магазины из всех городов, но приоритет выбранному городу
-        if city:
-            stmt = stmt.order_by(
-                (Store.city == city).desc(),  # Сначала из текущего города
-                Store.is_featured.desc(),
-                Store.rating.desc()
-            )
-        else:
-            stmt = stmt.order_by(Store.is_featured.desc(), Store.rating.desc())
-
-        # Только рекомендуемые
-        if featured is True:
-            stmt = stmt.where(Store.is_featured == True)
-
-        # Поиск по названию
-        if search:
-            search_term = f"%{search.lower()}%"
-            stmt = stmt.where(Store.name.ilike(search_term))
-
-        # Фильтр по категории - находим магазины с товарами данной категории
-        if category:
-            # Подзапрос: магазины, у которых есть товары в данной категории
-            subquery = select(Product.store_id).where(
-                Product.category == category,
-                Product.status == ProductStatus.ACTIVE
-            ).distinct()
-            stmt = stmt.where(Store.id.in_(subquery))
-
-        # Пагинация
-        stmt = stmt.offset(offset).limit(limit)
-
-        stores = session.exec(stmt).all()
-        logger.info(f"Найдено магазинов: {len(stores)}")
-
-        return [
-            StoreOut(
-                id=store.id,
-                name=store.name,
-                description=store.description,
-                short_description=store.short_description,
-                city=store.city,
-                rating=store.rating,
-                total_reviews=store.total_reviews,
-                total_sales=store.total_sales,
-                status=store.status.value,
-                is_featured=store.is_featured,
-                avatar_url=store.avatar_url,
-                created_at=store.created_at,
-                telegram_username=store.telegram_username
-            ) for store in stores
-        ]
-
-
-@router.get('/{store_id}', response_model=StoreDetailOut)
-def get_store_detail(store_id: int):
-    """Получает детальную информацию о магазине"""
-
-    logger.info(f"Запрос деталей магазина: {store_id}")
-
-    with get_session() as session:
-        store = session.get(Store, store_id)
-
-        if not store:
-            raise HTTPException(status_code=404, detail='Магазин не найден')
+    table_versions = await versions.get_versions_async(session, ("store", "product"))
+    unchanged = versions.not_modified(request, response, table_versions)
+    if unchanged:
+        return unchanged
+
+    cache_key = make_key("stores", city=city, featured=featured, category=category, search=search,
+                         limit=limit, offset=offset, cursor=cursor,
+                         versions=versions.versions_key(table_versions))
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        stores_out, next_cursor = cached
+        set_next_cursor(response, next_cursor)
+        return stores_out
+
+    # Показываем магазины из всех городов, но приоритет выбранному городу
+    order = [(Store.city == city, True)] if city else []
+    order += [(Store.is_featured, True), (Store.rating, True)]
+
+    # Поиск по названию: стемированный индекс, если он есть, иначе ilike
+    matched = None
+    if search and search_index.is_index_ready():
+        match_query = await search_index.build_match_query(session, search)
+        if not match_query:
+            # в запросе нет ни одного слова ("!!!") — искать нечего, фильтр не снимаем
+            return []
+        matched = search_index.store_match_subquery(match_query)
+        order.append((matched.c.rank, False))
+
+    # Keyset-пагинация: id в конце делает порядок строгим
+    keyset = Keyset(order + [(Store.id, True)])
+
+    # Базовый запрос только активных магазинов
+    stmt = select(Store, *keyset.columns).where(Store.status == StoreStatus.ACTIVE)
+    if matched is not None:
+        stmt = stmt.join(matched, matched.c.store_id == Store.id)
+
+    # Только рекомендуемые
+    if featured is True:
+        stmt = stmt.where(Store.is_featured == True)
+
+    if search and not search_index.is_index_ready():
+        search_term = f"%{search.lower()}%"
+        stmt = stmt.where(Store.name.ilike(search_term))
+
+    # Фильтр по категории - находим магазины с товарами данной категории
+    if category:
+        # Подзапрос: магазины, у которых есть товары в данной категории
+        subquery = select(Product.store_id).where(
+            Product.category == category,
+            Product.status == ProductStatus.ACTIVE
+        ).distinct()
+        stmt = stmt.where(Store.id.in_(subquery))
 
-        if store.status != StoreStatus.ACTIVE:
-            raise HTTPException(status_code=403, detail='Магазин недоступен')
+    stmt = keyset.apply(stmt, cursor, offset, limit)
 
-        # Считаем количество товаров
-        products_count_stmt = select(Product).where(
-            Product.store_id == store_id,
-            Product.status == ProductStatus.ACTIVE
-        )
-        products_count = len(session.exec(products_count_stmt).all())
+    stores, next_cursor = keyset.split((await session.exec(stmt)).all(), limit)
+    set_next_cursor(response, next_cursor)
+    logger.info(f"Найдено магазинов: {len(stores)}")
 
-        return StoreDetailOut(
+    stores_out = [
+        StoreOut(
             id=store.id,
             name=store.name,
             description=store.description,
             short_description=store.short_description,
             city=store.city,
-            address=store.address,
-            phone=store.phone,
-            email=store.email,
             rating=store.rating,
             total_reviews=store.total_reviews,
             total_sales=store.total_sales,
             status=store.status.value,
             is_featured=store.is_featured,
             avatar_url=store.avatar_url,
-            banner_url=store.banner_url,
             created_at=store.created_at,
-            telegram_username=store.telegram_username,
-            products_count=products_count
-        )
+            telegram_username=store.telegram_username
+        ) for store in stores
+    ]
+    catalog_cache.set(cache_key, (stores_out, next_cursor), tags=("store", "product"))
+    return stores_out
+
+
+@router.get('/{store_id}', response_model=StoreDetailOut)
+async def get_store_detail(
+        request: Request,
+        response: Response,
+        store_id: int,
+        session: AsyncSession = Depends(get_async_session)
+):
+    """Получает детальную информацию о магазине"""
+
+    logger.info(f"Запрос деталей магазина: {store_id}")
+
+    table_versions = await versions.get_versions_async(session, ("store", "product"))
+    unchanged = versions.not_modified(request, response, table_versions)
+    if unchanged:
+        return unchanged
+
+    store = await session.get(Store, store_id)
+
+    if not store:
+        raise HTTPException(status_code=404, detail='Магазин не найден')
+
+    if store.status != StoreStatus.ACTIVE:
+        raise HTTPException(status_code=403, detail='Магазин недоступен')
+
+    return StoreDetailOut(
+        id=store.id,
+        name=store.name,
+        description=store.description,
+        short_description=store.short_description,
+        city=store.city,
+        address=store.address,
+        phone=store.phone,
+        email=store.email,
+        rating=store.rating,
+        total_reviews=store.total_reviews,
+        total_sales=store.total_sales,
+        status=store.status.value,
+        is_featured=store.is_featured,
+        avatar_url=store.avatar_url,
+        banner_url=store.banner_url,
+        created_at=store.created_at,
+        telegram_username=store.telegram_username,
+        products_count=store.products_count
+    )
 
 
 @router.get('/{store_id}/products', response_model=List[ProductOut])
-def get_store_products(
+async def get_store_products(
+        request: Request,
+        response: Response,
         store_id: int,
         category: Optional[str] = Query(default=None, description="Категория"),
         limit: int = Query(default=20, le=50),
-        offset: int = Query(default=0)
+        offset: int = Query(default=0),
+        cursor: Optional[str] = Query(default=None, description="Курсор из заголовка X-Next-Cursor"),
+        session: AsyncSession = Depends(get_async_session)
 ):
     """Получает товары конкретного магазина"""
 
-    with get_session() as session:
-        # Проверяем существование магазина
-        store = session.get(Store, store_id)
-        if not store or store.status != StoreStatus.ACTIVE:
-            raise HTTPException(status_code=404, detail='Магазин не найден')
+    table_versions = await versions.get_versions_async(session, ("store", "product"))
+    unchanged = versions.not_modified(request, response, table_versions)
+    if unchanged:
+        return unchanged
 
-        # Запрос товаров
-        stmt = select(Product).where(
-            Product.store_id == store_id,
-            Product.status == ProductStatus.ACTIVE
-        )
-
-        if category:
-            stmt = stmt.where(Product.category == category)
-
-        stmt = stmt.order_by(Product.created_at.desc())
-        stmt = stmt.offset(offset).limit(limit)
-
-        products = session.exec(stmt).all()
-
-        return [
-            ProductOut(
-                id=product.id,
-                title=product.title,
-                short_description=product.short_description,
-                description=product.description,
-                price=product.price,
-                old_price=product.old_price,
-                main_image=product.main_image,
-                images=product.images,
-                category=product.category,
-                status=product.status.value,
-                store_name=store.name,
-                store_id=store.id,
-                quantity=product.quantity,
-                views=product.views
-            ) for product in products
-        ]
+    # Проверяем существование магазина
+    store = await session.get(Store, store_id)
+    if not store or store.status != StoreStatus.ACTIVE:
+        raise HTTPException(status_code=404, detail='Магазин не найден')
+
+    # Запрос товаров
+    keyset = Keyset([(Product.created_at, True), (Product.id, True)])
+    stmt = select(Product, *keyset.columns).where(
+        Product.store_id == store_id,
+        Product.status == ProductStatus.ACTIVE
+    )
+
+    if category:
+        stmt = stmt.where(Product.category == category)
+
+    stmt = keyset.apply(stmt, cursor, offset, limit)
+
+    products, next_cursor = keyset.split((await session.exec(stmt)).all(), limit)
+    set_next_cursor(response, next_cursor)
+
+    return [
+        ProductOut(
+            id=product.id,
+            title=product.title,
+            short_description=product.short_description,
+            description=product.description,
+            price=product.price,
+            old_price=product.old_price,
+            main_image=product.main_image,
+            images=product.images,
+            category=product.category,
+            status=product.status.value,
+            store_name=store.name,
+            store_id=store.id,
+            quantity=product.quantity,
+            views=product.views
+        ) for product in products
+    ]
 
 
 @router.get('/categories/', response_model=List[CategoryOut])
-def get_categories():
+async def get_categories(
+        request: Request,
+        response: Response,
+        session: AsyncSession = Depends(get_async_session)
+):
     """Получает список категорий с количеством товаров"""
 
-    with get_session() as session:
-        # Берем только активные категории
-        categories_stmt = select(Category).where(Category.is_active == True)
-        categories_stmt = categories_stmt.order_by(Category.sort_order, Category.name)
-        categories = session.exec(categories_stmt).all()
-
-        result = []
-        for category in categories:
-            # Считаем количество активных товаров в категории
-            products_stmt = select(Product).where(
-                Product.category == category.slug,
-                Product.status == ProductStatus.ACTIVE
-            )
-            products_count = len(session.exec(products_stmt).all())
-
-            result.append(CategoryOut(
-                id=category.id,
-                name=category.name,
-                slug=category.slug,
-                icon=category.icon,
-                description=category.description,
-                products_count=products_count
-            ))
-
-        return result
+    table_versions = await versions.get_versions_async(session, ("category", "product"))
+    unchanged = versions.not_modified(request, response, table_versions)
+    if unchanged:
+        return unchanged
+
+    cache_key = make_key("categories", versions=versions.versions_key(table_versions))
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Берем только активные категории
+    categories_stmt = select(Category).where(Category.is_active == True)
+    categories_stmt = categories_stmt.order_by(Category.sort_order, Category.name)
+    categories = (await session.exec(categories_stmt)).all()
+
+    # Количество товаров берем из счетчика, который обновляется при записи Product
+    result = []
+    for category in categories:
+        result.append(CategoryOut(
+            id=category.id,
+            name=category.name,
+            slug=category.slug,
+            icon=category.icon,
+            description=category.description,
+            products_count=category.products_count
+        ))
+
+    # products_count меняется вместе с Product
+    catalog_cache.set(cache_key, result, tags=("category", "product"))
+    return result
 
 
 @router.get('/featured/', response_model=List[StoreOut])
-def get_featured_stores(limit: int = Query(default=6, le=12)):
+async def get_featured_stores(
+        request: Request,
+        response: Response,
+        limit: int = Query(default=6, le=12),
+        session: AsyncSession = Depends(get_async_session)
+):
     """Получает рекомендуемые магазины"""
 
-    with get_session() as session:
-        stmt = select(Store).where(
-            Store.status == StoreStatus.ACTIVE,
-            Store.is_featured == True
-        ).order_by(Store.rating.desc()).limit(limit)
-
-        stores = session.exec(stmt).all()
-
-        return [
-            StoreOut(
-                id=store.id,
-                name=store.name,
-                description=store.description,
-                short_description=store.short_description,
-                city=store.city,
-                rating=store.rating,
-                total_reviews=store.total_reviews,
-                total_sales=store.total_sales,
-                status=store.status.value,
-                is_featured=store.is_featured,
-                avatar_url=store.avatar_url,
-                created_at=store.created_at,
-                telegram_username=store.telegram_username
-            ) for store in stores
-        ]
+    table_versions = await versions.get_versions_async(session, ("store",))
+    unchanged = versions.not_modified(request, response, table_versions)
+    if unchanged:
+        return unchanged
+
+    cache_key = make_key("featured", limit=limit, versions=versions.versions_key(table_versions))
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    stmt = select(Store).where(
+        Store.status == StoreStatus.ACTIVE,
+        Store.is_featured == True
+    ).order_by(Store.rating.desc()).limit(limit)
+
+    stores = (await session.exec(stmt)).all()
+
+    stores_out = [
+        StoreOut(
+            id=store.id,
+            name=store.name,
+            description=store.description,
+            short_description=store.short_description,
+            city=store.city,
+            rating=store.rating,
+            total_reviews=store.total_reviews,
+            total_sales=store.total_sales,
+            status=store.status.value,
+            is_featured=store.is_featured,
+            avatar_url=store.avatar_url,
+            created_at=store.created_at,
+            telegram_username=store.telegram_username
+        ) for store in stores
+    ]
+    catalog_cache.set(cache_key, stores_out, tags=("store",))
+    return stores_out
 
 
 # ИСПРАВЛЕНО: убираем обязательность query параметра
 @router.get('/search/', response_model=List[ProductOut])
-def search_products(
+async def search_products(
+        response: Response,
         query: str = Query(default="", description="Поисковый запрос"),  # ИСПРАВЛЕНО: убрали обязательность
         category: Optional[str] = Query(default=None),
         city: Optional[str] = Query(default="Москва"),
         limit: int = Query(default=50, le=100),
-        offset: int = Query(default=0)
+        offset: int = Query(default=0),
+        cursor: Optional[str] = Query(default=None, description="Курсор из заголовка X-Next-Cursor"),
+        session: AsyncSession = Depends(get_async_session)
 ):
     """Глобальный поиск товаров по всем магазинам"""
 
     # ИСПРАВЛЕНО: логируем все параметры
     logger.info(f"Поиск товаров: query='{query}', category={category}, city={city}")
 
-    with get_session() as session:
-        # Базовый запрос активных товаров из активных магазинов
-        stmt = select(Product, Store).join(Store).where(
-            Product.status == ProductStatus.ACTIVE,
-            Store.status == StoreStatus.ACTIVE
-        )
-
-        # ИСПРАВЛЕНО: если есть запрос - ищем по названию
-        if query and query.strip():
-            search_term = f"%{query.lower()}%"
-            stmt = stmt.where(Product.title.ilike(search_term))
-
-        # Фильтр по категории
-        if category:
-            stmt = stmt.where(Product.category == category)
-
-        # Приоритет товарам из выбранного города
-        if city:
-            stmt = stmt.order_by(
-                (Store.city == city).desc(),
-                Product.views.desc(),
-                Product.created_at.desc()
-            )
-        else:
-            stmt = stmt.order_by(Product.views.desc(), Product.created_at.desc())
-
-        stmt = stmt.offset(offset).limit(limit)
-        results = session.exec(stmt).all()
-
-        logger.info(f"Найдено товаров: {len(results)}")
-
-        return [
-            ProductOut(
-                id=product.id,
-                title=product.title,
-                short_description=product.short_description,
-                description=product.description,
-                price=product.price,
-                old_price=product.old_price,
-                main_image=product.main_image,
-                images=product.images,
-                category=product.category,
-                status=product.status.value,
-                store_name=store.name,
-                store_id=store.id,
-                quantity=product.quantity,
-                views=product.views
-            ) for product, store in results
-        ]
-
-
-@router.get('/product/{product_id}', response_model=ProductOut)
-def get_product_detail(product_id: int):
-    """Получает детальную информацию о товаре"""
-
-    logger.info(f"Запрос товара: {product_id}")
-
-    with get_session() as session:
-        # Получаем товар с информацией о магазине
-        stmt = select(Product, Store).join(Store).where(
-            Product.id == product_id,
-            Product.status == ProductStatus.ACTIVE,
-            Store.status == StoreStatus.ACTIVE
-        )
-        result = session.exec(stmt).first()
-
-        if not result:
-            raise HTTPException(status_code=404, detail='Товар не найден или недоступен')
-
-        product, store = result
-
-        # Увеличиваем счетчик просмотров
-        try:
-            product.views += 1
-            session.add(product)
-            session.commit()
-        except Exception as e:
-            logger.warning(f"Не удалось увеличить счетчик просмотров: {e}")
-
-        return ProductOut(
+    started = time.perf_counter()
+
+    # Релевантность BM25 из поискового индекса (если он есть) — после приоритета города
+    matched = None
+    if query and query.strip() and search_index.is_index_ready():
+        match_query = await search_index.build_match_query(session, query)
+        if not match_query:
+            # в запросе нет ни одного слова ("!!!") — искать нечего, фильтр не снимаем
+            return []
+        matched = search_index.product_match_subquery(match_query)
+
+    # Приоритет товарам из выбранного города
+    order = [(Store.city == city, True)] if city else []
+    if matched is not None:
+        order.append((matched.c.rank, False))
+    keyset = Keyset(order + [(Product.views, True), (Product.created_at, True), (Product.id, True)])
+
+    # Базовый запрос активных товаров из активных магазинов
+    stmt = select(Product, Store, *keyset.columns).join(Store).where(
+        Product.status == ProductStatus.ACTIVE,
+        Store.status == StoreStatus.ACTIVE
+    )
+    if matched is not None:
+        stmt = stmt.join(matched, matched.c.product_id == Product.id)
+    elif query and query.strip() and not search_index.is_index_ready():
+        # Fallback без FTS5: поиск по названию
+        search_term = f"%{query.lower()}%"
+        stmt = stmt.where(Product.title.ilike(search_term))
+
+    # Фильтр по категории
+    if category:
+        stmt = stmt.where(Product.category == category)
+
+    stmt = keyset.apply(stmt, cursor, offset, limit)
+
+    results, next_cursor = keyset.split((await session.exec(stmt)).all(), limit)
+    set_next_cursor(response, next_cursor)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    search_index.record_timing(elapsed_ms)
+    response.headers["Server-Timing"] = f"search;dur={elapsed_ms:.1f}"
+
+    logger.info(f"Найдено товаров: {len(results)} за {elapsed_ms:.1f} мс")
+
+    return [
+        ProductOut(
             id=product.id,
             title=product.title,
             short_description=product.short_description,
@@ -396,67 +436,134 @@ def get_product_detail(product_id: int):
             store_id=store.id,
             quantity=product.quantity,
             views=product.views
-        )
+        ) for product, store in results
+    ]
+
+
+@router.get('/search/stats')
+def get_search_stats():
+    """Время поиска по последним запросам (p50 / p95 / max, мс)"""
+    return {"index_ready": search_index.is_index_ready(), **search_index.timing_stats()}
+
+
+@router.get('/cache/stats')
+def get_cache_stats():
+    """Попадания / промахи кешей каталога, настроек и чеков (для подбора CATALOG_CACHE_SIZE и TTL)"""
+    return {"catalog": catalog_cache.stats(), "settings": settings_cache.stats(), "receipts": receipt_cache.stats()}
+
+
+@router.get('/product/{product_id}', response_model=ProductOut)
+async def get_product_detail(product_id: int, session: AsyncSession = Depends(get_async_session)):
+    """Получает детальную информацию о товаре"""
+
+    logger.info(f"Запрос товара: {product_id}")
+
+    # Получаем товар с информацией о магазине
+    stmt = select(Product, Store).join(Store).where(
+        Product.id == product_id,
+        Product.status == ProductStatus.ACTIVE,
+        Store.status == StoreStatus.ACTIVE
+    )
+    result = (await session.exec(stmt)).first()
+
+    if not result:
+        raise HTTPException(status_code=404, detail='Товар не найден или недоступен')
+
+    product, store = result
+
+    # Просмотр копится в памяти и пишется в БД пакетом (backend/view_counter.py)
+    view_counter.record(product.id)
+
+    return ProductOut(
+        id=product.id,
+        title=product.title,
+        short_description=product.short_description,
+        description=product.description,
+        price=product.price,
+        old_price=product.old_price,
+        main_image=product.main_image,
+        images=product.images,
+        category=product.category,
+        status=product.status.value,
+        store_name=store.name,
+        store_id=store.id,
+        quantity=product.quantity,
+        views=product.views + view_counter.pending(product.id)
+    )
 
 
 @router.get('/category/{category_slug}', response_model=List[ProductOut])
-def get_category_products(
+async def get_category_products(
+        request: Request,
+        response: Response,
         category_slug: str,
         city: Optional[str] = Query(default="Москва"),
         limit: int = Query(default=50, le=100),
-        offset: int = Query(default=0)
+        offset: int = Query(default=0),
+        cursor: Optional[str] = Query(default=None, description="Курсор из заголовка X-Next-Cursor"),
+        session: AsyncSession = Depends(get_async_session)
 ):
     """Получает товары конкретной категории"""
 
     logger.info(f"Запрос товаров категории: {category_slug}, city={city}")
 
-    with get_session() as session:
-        # Проверяем существование категории
-        category = session.exec(select(Category).where(
-            Category.slug == category_slug,
-            Category.is_active == True
-        )).first()
-
-        if not category:
-            raise HTTPException(status_code=404, detail='Категория не найдена')
-
-        # Получаем товары категории
-        stmt = select(Product, Store).join(Store).where(
-            Product.category == category_slug,
-            Product.status == ProductStatus.ACTIVE,
-            Store.status == StoreStatus.ACTIVE
-        )
-
-        # Приоритет товарам из выбранного города
-        if city:
-            stmt = stmt.order_by(
-                (Store.city == city).desc(),
-                Product.views.desc(),
-                Product.created_at.desc()
-            )
-        else:
-            stmt = stmt.order_by(Product.views.desc(), Product.created_at.desc())
-
-        stmt = stmt.offset(offset).limit(limit)
-        results = session.exec(stmt).all()
-
-        logger.info(f"Найдено товаров в категории {category_slug}: {len(results)}")
-
-        return [
-            ProductOut(
-                id=product.id,
-                title=product.title,
-                short_description=product.short_description,
-                description=product.description,
-                price=product.price,
-                old_price=product.old_price,
-                main_image=product.main_image,
-                images=product.images,
-                category=product.category,
-                status=product.status.value,
-                store_name=store.name,
-                store_id=store.id,
-                quantity=product.quantity,
-                views=product.views
-            ) for product, store in results
-        ]
\ No newline at end of file
+    table_versions = await versions.get_versions_async(session, ("category", "product", "store"))
+    unchanged = versions.not_modified(request, response, table_versions)
+    if unchanged:
+        return unchanged
+
+    cache_key = make_key("category_products", category=category_slug, city=city,
+                         limit=limit, offset=offset, cursor=cursor,
+                         versions=versions.versions_key(table_versions))
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        products_out, next_cursor = cached
+        set_next_cursor(response, next_cursor)
+        return products_out
+
+    # Проверяем существование категории
+    category = (await session.exec(select(Category).where(
+        Category.slug == category_slug,
+        Category.is_active == True
+    ))).first()
+
+    if not category:
+        raise HTTPException(status_code=404, detail='Категория не найдена')
+
+    # Приоритет товарам из выбранного города
+    order = [(Store.city == city, True)] if city else []
+    keyset = Keyset(order + [(Product.views, True), (Product.created_at, True), (Product.id, True)])
+
+    # Получаем товары категории
+    stmt = select(Product, Store, *keyset.columns).join(Store).where(
+        Product.category == category_slug,
+        Product.status == ProductStatus.ACTIVE,
+        Store.status == StoreStatus.ACTIVE
+    )
+    stmt = keyset.apply(stmt, cursor, offset, limit)
+
+    results, next_cursor = keyset.split((await session.exec(stmt)).all(), limit)
+    set_next_cursor(response, next_cursor)
+
+    logger.info(f"Найдено товаров в категории {category_slug}: {len(results)}")
+
+    products_out = [
+        ProductOut(
+            id=product.id,
+            title=product.title,
+            short_description=product.short_description,
+            description=product.description,
+            price=product.price,
+            old_price=product.old_price,
+            main_image=product.main_image,
+            images=product.images,
+            category=product.category,
+            status=product.status.value,
+            store_name=store.name,
+            store_id=store.id,
+            quantity=product.quantity,
+            views=product.views
+        ) for product, store in results
+    ]
+    catalog_cache.set(cache_key, (products_out, next_cursor), tags=("category", "product", "store"))
+    return products_out
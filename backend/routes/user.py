@@ -1,9 +1,11 @@
 ﻿# backend/routes/user.py - КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ: убираем 422 ошибки
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, Field, validator
 from sqlmodel import select
-from backend.db import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from backend.db import get_session, get_async_session, write_session
 from backend.models import User
+from backend.activity import activity_tracker
 from datetime import datetime
 import logging
 import json
@@ -95,7 +97,7 @@ def create_or_update_user(payload: UserIn):
 
     logger.info(f"👤 Создание/обновление пользователя: tg_id={payload.tg_id}")
 
-    with get_session() as session:
+    with write_session() as session:
         try:
             # Ищем существующего пользователя
             stmt = select(User).where(User.tg_id == payload.tg_id)
@@ -220,25 +222,23 @@ def create_or_update_user(payload: UserIn):
 
 
 @router.get('/user/{tg_id}', response_model=UserOut)
-def get_user(tg_id: int):
+async def get_user(tg_id: int, session: AsyncSession = Depends(get_async_session)):
     """Получает пользователя по Telegram ID"""
     if tg_id <= 0:
         raise HTTPException(status_code=400, detail='Некорректный Telegram ID')
 
-    with get_session() as session:
-        stmt = select(User).where(User.tg_id == tg_id)
-        user = session.exec(stmt).first()
+    stmt = select(User).where(User.tg_id == tg_id)
+    user = (await session.exec(stmt)).first()
 
-        if not user:
-            raise HTTPException(status_code=404, detail='Пользователь не найден')
+    if not user:
+        raise HTTPException(status_code=404, detail='Пользователь не найден')
 
-        # Обновляем последнюю активность
-        user.last_active = datetime.utcnow()
-        session.add(user)
-        session.commit()
-        session.refresh(user)
+    # last_active пишется в БД пакетно и не чаще раза в LAST_ACTIVE_GRANULARITY (backend/activity.py)
+    last_active = activity_tracker.touch(user.id, user.last_active)
+    session.expunge(user)
+    user.last_active = last_active
 
-        return user
+    return user
 
 
 @router.put('/user/{tg_id}/balance')
@@ -253,7 +253,7 @@ def update_user_balance(tg_id: int, data: dict):
     if tg_id <= 0:
         raise HTTPException(status_code=400, detail='Некорректный Telegram ID')
 
-    with get_session() as session:
+    with write_session() as session:
         user = session.exec(select(User).where(User.tg_id == tg_id)).first()
         if not user:
             raise HTTPException(status_code=404, detail='Пользователь не найден')
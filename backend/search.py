@@ -0,0 +1,295 @@
+# backend/search.py - поиск по каталогу с учетом русской морфологии
+# Индексы product_search / store_search (SQLite FTS5) хранят уже нормализованный
+# текст: стемы (Snowball), ё→е, нижний регистр — см. backend/text_ru.py.
+# Стемминг делается в Python, поэтому индексы синхронизируются обработчиком
+# сессии (after_flush), а не SQL-триггерами. Словарь терминов search_terms
+# с триграммным FTS-индексом дает нечеткий поиск по опечаткам.
+# Если индекса нет (другая СУБД или SQLite без FTS5), роуты используют ilike.
+# Пересборка вручную: python -m backend.search
+from collections import deque
+from sqlalchemy import event, text, select, inspect, Table, Column, Integer, Float, String, MetaData, literal_column
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Set
+import logging
+import statistics
+
+from backend.models import Product, Store
+from backend import text_ru
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_INDEX = "product_search"
+PRODUCT_COLUMNS = ["title", "short_description", "description", "tags", "category"]
+# Веса BM25 по колонкам (в порядке PRODUCT_COLUMNS): совпадение в названии важнее описания
+PRODUCT_WEIGHTS = (10.0, 4.0, 1.0, 3.0, 2.0)
+
+STORE_INDEX = "store_search"
+STORE_COLUMNS = ["name", "short_description"]
+STORE_WEIGHTS = (10.0, 1.0)
+
+TERMS_TABLE = "search_terms"
+TRIGRAM_TABLE = "search_terms_trigram"
+
+MAX_QUERY_TOKENS = 8
+FUZZY_MIN_LENGTH = 4       # короче — опечатки не исправляем, слишком много ложных совпадений
+FUZZY_CANDIDATES = 50      # сколько кандидатов берем из триграммного индекса
+FUZZY_MAX_TERMS = 5        # сколько исправлений подставляем в запрос на одно слово
+REBUILD_BATCH = 1000
+
+_terms = Table(TERMS_TABLE, MetaData(), Column("id", Integer, primary_key=True), Column("term", String))
+_trigram = Table(TRIGRAM_TABLE, MetaData(), Column("term", String))
+
+_index_ready = None
+_fuzzy_ready = None
+_timings = deque(maxlen=2000)
+
+
+# ---------- Схема и пересборка ----------
+
+def create_search_index(conn: Connection):
+    """Создает FTS5-индексы, словарь терминов и наполняет их"""
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCT_INDEX} USING fts5("
+        f"{', '.join(PRODUCT_COLUMNS)}, tokenize='unicode61 remove_diacritics 2')"
+    ))
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {STORE_INDEX} USING fts5("
+        f"{', '.join(STORE_COLUMNS)}, tokenize='unicode61 remove_diacritics 2')"
+    ))
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {TERMS_TABLE} ("
+        f"id INTEGER PRIMARY KEY, term VARCHAR(100) NOT NULL UNIQUE)"
+    ))
+    try:
+        with conn.begin_nested():
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TRIGRAM_TABLE} USING fts5("
+                f"term, content='{TERMS_TABLE}', content_rowid='id', tokenize='trigram')"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {TRIGRAM_TABLE}_ai AFTER INSERT ON {TERMS_TABLE} BEGIN "
+                f"INSERT INTO {TRIGRAM_TABLE}(rowid, term) VALUES (new.id, new.term); END"
+            ))
+    except OperationalError as e:
+        # триграммный токенайзер есть в SQLite >= 3.34
+        logger.warning(f"⚠️ Триграммный FTS5 недоступен, нечеткий поиск отключен: {e}")
+    rebuild_search_index(conn)
+
+
+def rebuild_search_index(conn: Connection):
+    """Полностью перестраивает индексы поиска по текущим product и store"""
+    conn.execute(text(f"DELETE FROM {PRODUCT_INDEX}"))
+    conn.execute(text(f"DELETE FROM {STORE_INDEX}"))
+    conn.execute(text(f"DELETE FROM {TERMS_TABLE}"))
+
+    for model, index, columns in ((Product, PRODUCT_INDEX, PRODUCT_COLUMNS), (Store, STORE_INDEX, STORE_COLUMNS)):
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(model.id, *[getattr(model, c) for c in columns])
+                .where(model.id > last_id)
+                .order_by(model.id)
+                .limit(REBUILD_BATCH)
+            ).all()
+            if not rows:
+                break
+            _index_rows(conn, index, columns, rows, replace=False)
+            last_id = rows[-1][0]
+
+    if _has_table(conn, TRIGRAM_TABLE):
+        conn.execute(text(f"INSERT INTO {TRIGRAM_TABLE}({TRIGRAM_TABLE}) VALUES ('rebuild')"))
+    logger.info("✅ Поисковый индекс пересобран")
+
+
+def _has_table(conn: Connection, name: str) -> bool:
+    row = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": name}
+    ).first()
+    return row is not None
+
+
+def check_index_ready(conn: Connection) -> bool:
+    """Проверяет наличие индексов и запоминает результат"""
+    global _index_ready, _fuzzy_ready
+    if conn.dialect.name != "sqlite":
+        _index_ready = _fuzzy_ready = False
+    else:
+        _index_ready = _has_table(conn, PRODUCT_INDEX) and _has_table(conn, STORE_INDEX)
+        _fuzzy_ready = _index_ready and _has_table(conn, TRIGRAM_TABLE)
+    return _index_ready
+
+
+def is_index_ready() -> bool:
+    return bool(_index_ready)
+
+
+# ---------- Синхронизация с записями Product / Store ----------
+
+def _index_rows(conn: Connection, index: str, columns: List[str], rows: Iterable, replace: bool = True):
+    params = []
+    terms: Set[str] = set()
+    for row in rows:
+        item = {"rowid": row[0]}
+        for column, value in zip(columns, row[1:]):
+            stems = text_ru.stem_text(value or "")
+            item[column] = stems
+            terms.update(t for t in stems.split() if len(t) >= 3)
+        params.append(item)
+    if not params:
+        return
+    if replace:
+        conn.execute(text(f"DELETE FROM {index} WHERE rowid = :rowid"), [{"rowid": p["rowid"]} for p in params])
+    placeholders = ", ".join(f":{c}" for c in columns)
+    conn.execute(
+        text(f"INSERT INTO {index}(rowid, {', '.join(columns)}) VALUES (:rowid, {placeholders})"),
+        params
+    )
+    if terms:
+        conn.execute(text(f"INSERT OR IGNORE INTO {TERMS_TABLE}(term) VALUES (:term)"), [{"term": t} for t in terms])
+
+
+def _remove_rows(conn: Connection, index: str, ids: Iterable[int]):
+    params = [{"rowid": i} for i in ids]
+    if params:
+        conn.execute(text(f"DELETE FROM {index} WHERE rowid = :rowid"), params)
+
+
+def _text_changed(obj, columns: List[str]) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[c].history.has_changes() for c in columns)
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_search_index(session, flush_context):
+    targets = ((Product, PRODUCT_INDEX, PRODUCT_COLUMNS), (Store, STORE_INDEX, STORE_COLUMNS))
+    changed: Dict[str, list] = {}
+    deleted: Dict[str, list] = {}
+    for model, index, columns in targets:
+        changed[index] = [
+            obj for obj in list(session.new) + list(session.dirty)
+            if isinstance(obj, model) and (obj in session.new or _text_changed(obj, columns))
+        ]
+        deleted[index] = [obj.id for obj in session.deleted if isinstance(obj, model)]
+    if not any(changed.values()) and not any(deleted.values()):
+        return
+
+    conn = session.connection()
+    if _index_ready is None:
+        check_index_ready(conn)
+    if not _index_ready:
+        return
+
+    for model, index, columns in targets:
+        _remove_rows(conn, index, deleted[index])
+        rows = [(obj.id, *[getattr(obj, c) for c in columns]) for obj in changed[index]]
+        _index_rows(conn, index, columns, rows)
+
+
+# ---------- Запросы ----------
+
+def query_alternatives(token: str) -> Set[str]:
+    """Варианты слова запроса: стем + транслитерация в обе стороны"""
+    alternatives = {text_ru.stem(token)}
+    if text_ru.is_latin(token):
+        alternatives.add(text_ru.stem(text_ru.translit_to_cyrillic(token)))
+    elif text_ru.is_cyrillic(token):
+        alternatives.add(text_ru.translit_to_latin(token))
+    return {a for a in alternatives if a}
+
+
+async def _has_prefix_match(session, alternatives: Set[str]) -> bool:
+    for alt in alternatives:
+        stmt = select(_terms.c.id).where(_terms.c.term >= alt, _terms.c.term < alt + "\uffff").limit(1)
+        if (await session.exec(stmt)).first() is not None:
+            return True
+    return False
+
+
+async def _fuzzy_terms(session, word: str) -> Set[str]:
+    """Термины словаря в пределах 1–2 опечаток от слова (кандидаты — по триграммам)"""
+    grams = text_ru.trigrams(word)
+    if not grams:
+        return set()
+    match = " OR ".join(f'"{g}"' for g in set(grams))
+    stmt = (
+        select(_trigram.c.term)
+        .where(literal_column(TRIGRAM_TABLE).op("MATCH")(match))
+        .order_by(literal_column("rank"))
+        .limit(FUZZY_CANDIDATES)
+    )
+    limit = 1 if len(word) <= 5 else 2
+    scored = []
+    for (term,) in (await session.exec(stmt)).all():
+        distance = text_ru.levenshtein(word, term, limit)
+        # опечатка в окончании: сравниваем и с началом термина той же длины
+        if distance > limit and len(term) > len(word):
+            distance = text_ru.levenshtein(word, term[:len(word)], limit)
+        if distance <= limit:
+            scored.append((distance, term))
+    return {term for _, term in sorted(scored)[:FUZZY_MAX_TERMS]}
+
+
+async def build_match_query(session, query: str) -> str:
+    """Пользовательский ввод → FTS5-запрос по стемам
+
+    Каждое слово раскрывается в варианты (стем, транслитерация, исправления
+    опечаток), варианты ищутся по префиксу через OR, слова — через AND.
+    Все варианты берутся в кавычки, поэтому синтаксис FTS5 из ввода не проходит.
+    """
+    groups = []
+    for token in text_ru.tokenize(query)[:MAX_QUERY_TOKENS]:
+        alternatives = query_alternatives(token)
+        if _fuzzy_ready and len(token) >= FUZZY_MIN_LENGTH and not await _has_prefix_match(session, alternatives):
+            alternatives |= await _fuzzy_terms(session, text_ru.stem(token))
+        groups.append("(" + " OR ".join(f'"{a}"*' for a in sorted(alternatives)) + ")")
+    return " AND ".join(groups)
+
+
+def _match_subquery(index: str, weights, match_query: str, id_column: str):
+    weights_sql = ", ".join(str(w) for w in weights)
+    return text(
+        f"SELECT rowid AS {id_column}, bm25({index}, {weights_sql}) AS rank "
+        f"FROM {index} WHERE {index} MATCH :match_query"
+    ).bindparams(match_query=match_query).columns(**{id_column: Integer, "rank": Float}).subquery(index)
+
+
+def product_match_subquery(match_query: str):
+    """Подзапрос (product_id, rank) для join с Product; меньший rank — лучше"""
+    return _match_subquery(PRODUCT_INDEX, PRODUCT_WEIGHTS, match_query, "product_id")
+
+
+def store_match_subquery(match_query: str):
+    """Подзапрос (store_id, rank) для join со Store; меньший rank — лучше"""
+    return _match_subquery(STORE_INDEX, STORE_WEIGHTS, match_query, "store_id")
+
+
+# ---------- Замеры ----------
+
+def record_timing(ms: float):
+    _timings.append(ms)
+
+
+def timing_stats() -> dict:
+    """Время последних поисковых запросов (мс)"""
+    samples = sorted(_timings)
+    if not samples:
+        return {"count": 0, "p50_ms": None, "p95_ms": None, "max_ms": None}
+    p95_index = max(0, int(round(len(samples) * 0.95)) - 1)
+    return {
+        "count": len(samples),
+        "p50_ms": round(statistics.median(samples), 2),
+        "p95_ms": round(samples[p95_index], 2),
+        "max_ms": round(samples[-1], 2),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from backend.db import engine
+
+    with engine.begin() as connection:
+        rebuild_search_index(connection)
+    print("✅ Поисковый индекс пересобран")
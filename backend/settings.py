@@ -0,0 +1,79 @@
+# backend/settings.py - типизированные настройки из SystemSettings
+# Вся таблица читается одним запросом и хранится в settings_cache вместе с
+# версией таблицы (TableVersion). Коммит, меняющий SystemSettings, сбрасывает
+# кеш сразу (во всех воркерах при общем бэкенде кеша); воркеры с кешем в памяти
+# раз в SETTINGS_VERSION_CHECK секунд сверяют версию и перечитывают таблицу,
+# только если она изменилась. Новые настройки не добавляют запросов.
+from dataclasses import dataclass, fields
+from sqlmodel import select
+from typing import Dict, Optional
+import os
+import time
+
+from backend.cache import settings_cache, make_key
+from backend.db import get_session
+from backend.models import SystemSettings, TableVersion
+
+SETTINGS_VERSION_CHECK = float(os.getenv('SETTINGS_VERSION_CHECK', '5'))
+
+_CACHE_KEY = make_key("system_settings")
+
+
+@dataclass(frozen=True)
+class PaymentSettings:
+    """Реквизиты для пополнения; поле X берется из настройки payment_X"""
+    card_number: str = "5536 9141 2345 6789"
+    card_holder: str = "VOID SHOP"
+    bank_name: str = "Сбер Банк"
+    btc_wallet: str = "bc1qxy2kgdygjrsqtzq2n0yrf2493p83kkfjhx0wlh"
+    usdt_wallet: str = "TQRRm4Pg5wKTZJhP5QiCEkT3JzRzJ3qS4F"
+
+    @classmethod
+    def from_values(cls, values: Dict[str, str]) -> "PaymentSettings":
+        return cls(**{
+            field.name: values[f"payment_{field.name}"]
+            for field in fields(cls)
+            if f"payment_{field.name}" in values
+        })
+
+
+def _table_version(session) -> int:
+    row = session.get(TableVersion, "system_settings")
+    return row.version if row else 0
+
+
+class SettingsStore:
+    def __init__(self, check_interval: float = SETTINGS_VERSION_CHECK):
+        self.check_interval = check_interval
+        self._checked_at = 0.0
+
+    def values(self) -> Dict[str, str]:
+        """Все настройки {key: value}"""
+        cached = settings_cache.get(_CACHE_KEY)
+        if cached is not None:
+            version, values = cached
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return values
+            with get_session() as session:
+                if _table_version(session) == version:
+                    self._checked_at = time.monotonic()
+                    return values
+        return self.reload()
+
+    def reload(self) -> Dict[str, str]:
+        with get_session() as session:
+            # версия читается до данных: если между ними была запись, следующая проверка перечитает
+            version = _table_version(session)
+            values = {setting.key: setting.value for setting in session.exec(select(SystemSettings)).all()}
+        settings_cache.set(_CACHE_KEY, (version, values), tags=("system_settings",))
+        self._checked_at = time.monotonic()
+        return values
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self.values().get(key, default)
+
+    def payment(self) -> PaymentSettings:
+        return PaymentSettings.from_values(self.values())
+
+
+system_settings = SettingsStore()
@@ -0,0 +1,199 @@
+# backend/text_ru.py - нормализация русского текста для поиска
+# Токенизация, свертка ё→е, стемминг (алгоритм Snowball для русского языка),
+# транслитерация и расстояние Левенштейна для нечеткого поиска.
+# Чистый Python без внешних зависимостей.
+from functools import lru_cache
+from typing import List
+import re
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_CYRILLIC_RE = re.compile(r"[а-я]")
+_LATIN_RE = re.compile(r"^[a-z]+$")
+
+_VOWELS = set("аеиоуыэюя")
+
+# Окончания Snowball. Для групп "*_1" окончание удаляется, только если перед ним стоит "а" или "я".
+_PERFECTIVE_GERUND_1 = ("в", "вши", "вшись")
+_PERFECTIVE_GERUND_2 = ("ив", "ивши", "ившись", "ыв", "ывши", "ывшись")
+_ADJECTIVE = (
+    "ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+    "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+)
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_REFLEXIVE = ("ся", "сь")
+_VERB_1 = ("ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны", "ть", "ешь", "нно")
+_VERB_2 = (
+    "ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл", "им", "ым",
+    "ен", "ило", "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить", "ыть", "ишь", "ую", "ю",
+)
+_NOUN = (
+    "а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей", "ой", "ий",
+    "й", "иям", "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы", "ь", "ию", "ью", "ю",
+    "ия", "ья", "я",
+)
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+_LAT_TO_CYR = [
+    ("shch", "щ"), ("sch", "щ"), ("yo", "е"), ("zh", "ж"), ("kh", "х"), ("ts", "ц"), ("ch", "ч"),
+    ("sh", "ш"), ("yu", "ю"), ("ya", "я"), ("ye", "е"),
+    ("a", "а"), ("b", "б"), ("v", "в"), ("g", "г"), ("d", "д"), ("e", "е"), ("z", "з"), ("i", "и"),
+    ("y", "ы"), ("j", "й"), ("k", "к"), ("l", "л"), ("m", "м"), ("n", "н"), ("o", "о"), ("p", "п"),
+    ("r", "р"), ("s", "с"), ("t", "т"), ("u", "у"), ("f", "ф"), ("h", "х"), ("c", "к"), ("w", "в"),
+    ("x", "кс"), ("q", "к"),
+]
+_CYR_TO_LAT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s",
+    "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch",
+    "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+
+
+def fold(text: str) -> str:
+    """Нижний регистр и ё → е"""
+    return text.lower().replace("ё", "е")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(fold(text or ""))
+
+
+def is_cyrillic(word: str) -> bool:
+    return bool(_CYRILLIC_RE.search(word))
+
+
+def is_latin(word: str) -> bool:
+    return bool(_LATIN_RE.match(word))
+
+
+def _regions(word: str):
+    """Границы RV и R2 по правилам Snowball"""
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def _strip_suffix(word: str, start: int, plain, after_a_ya=()):
+    """Удаляет самое длинное подходящее окончание, лежащее в регионе [start:]"""
+    region = word[start:]
+    candidates = sorted(plain + after_a_ya, key=len, reverse=True)
+    for ending in candidates:
+        if not region.endswith(ending):
+            continue
+        stem = word[:len(word) - len(ending)]
+        if ending in after_a_ya and ending not in plain:
+            if len(stem) <= start or stem[-1] not in "ая":
+                continue
+        return stem
+    return None
+
+
+@lru_cache(maxsize=200_000)
+def stem(word: str) -> str:
+    """Стем русского слова (Snowball); латиница и числа возвращаются как есть"""
+    word = fold(word)
+    if not is_cyrillic(word) or len(word) < 3:
+        return word
+
+    rv, r2 = _regions(word)
+
+    # Шаг 1
+    stemmed = _strip_suffix(word, rv, _PERFECTIVE_GERUND_2, _PERFECTIVE_GERUND_1)
+    if stemmed is None:
+        word = _strip_suffix(word, rv, _REFLEXIVE) or word
+        adjectival = _strip_suffix(word, rv, _ADJECTIVE)
+        if adjectival is not None:
+            stemmed = _strip_suffix(adjectival, rv, _PARTICIPLE_2, _PARTICIPLE_1) or adjectival
+        else:
+            stemmed = _strip_suffix(word, rv, _VERB_2, _VERB_1)
+            if stemmed is None:
+                stemmed = _strip_suffix(word, rv, _NOUN)
+    word = stemmed if stemmed is not None else word
+
+    # Шаг 2
+    if word.endswith("и") and len(word) > rv:
+        word = word[:-1]
+
+    # Шаг 3
+    word = _strip_suffix(word, r2, _DERIVATIONAL) or word
+
+    # Шаг 4
+    if word.endswith("нн") and len(word) - 1 > rv:
+        word = word[:-1]
+    else:
+        superlative = _strip_suffix(word, rv, _SUPERLATIVE)
+        if superlative is not None:
+            word = superlative
+            if word.endswith("нн"):
+                word = word[:-1]
+        elif word.endswith("ь") and len(word) > rv:
+            word = word[:-1]
+
+    # Дополнение к Snowball: беглая гласная (кроссовок / кроссовки, платок / платка)
+    if len(word) >= 5 and word[-1] == "к" and word[-2] in "ое" and word[-3] not in _VOWELS:
+        word = word[:-2] + "к"
+
+    return word
+
+
+def stem_text(text: str) -> str:
+    """Текст → строка стемов через пробел (то, что кладется в индекс)"""
+    return " ".join(stem(token) for token in tokenize(text))
+
+
+def translit_to_cyrillic(word: str) -> str:
+    """krossovki → кроссовки"""
+    result = []
+    i = 0
+    while i < len(word):
+        for lat, cyr in _LAT_TO_CYR:
+            if word.startswith(lat, i):
+                result.append(cyr)
+                i += len(lat)
+                break
+        else:
+            result.append(word[i])
+            i += 1
+    return "".join(result)
+
+
+def translit_to_latin(word: str) -> str:
+    """адидас → adidas"""
+    return "".join(_CYR_TO_LAT.get(ch, ch) for ch in fold(word))
+
+
+def trigrams(word: str) -> List[str]:
+    return [word[i:i + 3] for i in range(len(word) - 2)]
+
+
+def levenshtein(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна с ранним выходом: > limit возвращается как limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
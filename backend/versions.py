@@ -0,0 +1,98 @@
+# backend/versions.py - версии таблиц для условных HTTP-запросов (ETag / 304)
+# Коммит, изменивший Store / Product / Category / SystemSettings, в той же
+# транзакции увеличивает версию таблицы в TableVersion. ETag ответа — хеш URL и
+# версий таблиц, от которых он зависит, поэтому If-None-Match проверяется одним
+# SELECT по крошечной таблице, без сборки ответа. Таблица общая для всех воркеров.
+# Те же версии входят в ключ catalog_cache (versions_key): кеш в памяти воркера
+# не сбрасывается записью из другого процесса, но после смены версии ответ
+# ищется по новому ключу, и тело всегда соответствует отданному ETag.
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request, Response
+from sqlalchemy import event, update, insert
+from sqlalchemy.orm import Session
+from sqlmodel import select
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+import hashlib
+
+from backend.cache import changed_tables
+from backend.models import TableVersion
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_table_versions(session, flush_context):
+    changed = changed_tables(session)
+    if changed:
+        bump_versions(session.connection(), changed)
+
+
+def bump_versions(conn, tags: Iterable[str]) -> None:
+    """Увеличивает версии таблиц (для изменений мимо ORM вызывать вручную)"""
+    now = datetime.now(timezone.utc)
+    for name in sorted(set(tags)):
+        result = conn.execute(
+            update(TableVersion)
+            .where(TableVersion.name == name)
+            .values(version=TableVersion.version + 1, changed_at=now)
+        )
+        if result.rowcount == 0:
+            conn.execute(insert(TableVersion).values(name=name, version=1, changed_at=now))
+
+
+def _versions_stmt(tags: Iterable[str]):
+    return select(TableVersion).where(TableVersion.name.in_(sorted(set(tags))))
+
+
+def get_versions(session, tags: Iterable[str]) -> List[TableVersion]:
+    return list(session.exec(_versions_stmt(tags)).all())
+
+
+async def get_versions_async(session, tags: Iterable[str]) -> List[TableVersion]:
+    return list((await session.exec(_versions_stmt(tags))).all())
+
+
+def versions_key(versions: List[TableVersion]) -> tuple:
+    """Версии таблиц для ключа кеша: при записи в любом процессе ключ меняется"""
+    return tuple(sorted((v.name, v.version) for v in versions))
+
+
+def _etag(request: Request, versions: List[TableVersion]) -> str:
+    raw = str(request.url.path) + "?" + str(request.url.query) + "|" + ",".join(
+        f"{v.name}:{v.version}" for v in sorted(versions, key=lambda v: v.name)
+    )
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def not_modified(request: Request, response: Response, versions: List[TableVersion]) -> Optional[Response]:
+    """Ставит ETag / Last-Modified и возвращает 304, если клиентская копия актуальна"""
+    etag = _etag(request, versions)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    last_modified = max((_as_utc(v.changed_at) for v in versions), default=None)
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        fresh = etag_matches(if_none_match, etag)
+    elif last_modified and request.headers.get("if-modified-since"):
+        try:
+            since = _as_utc(parsedate_to_datetime(request.headers["if-modified-since"]))
+        except (TypeError, ValueError):
+            return None
+        fresh = last_modified.replace(microsecond=0) <= since
+    else:
+        return None
+
+    return Response(status_code=304, headers=headers) if fresh else None
@@ -0,0 +1,65 @@
+# backend/view_counter.py - буферизованный счетчик просмотров товаров
+# Просмотр товара не пишет в БД: он копится в памяти процесса, а раз в
+# VIEW_FLUSH_INTERVAL секунд накопленное записывается одной транзакцией
+# UPDATE product SET views = views + n (executemany). При остановке приложения
+# буфер сбрасывается; при падении процесса теряются только просмотры
+# за последний интервал.
+from collections import Counter
+from sqlalchemy import update, bindparam
+import logging
+import os
+import threading
+
+from backend.buffered import PeriodicFlusher
+from backend.db import engine, write_guard
+from backend.models import Product
+
+logger = logging.getLogger(__name__)
+
+VIEW_FLUSH_INTERVAL = float(os.getenv('VIEW_FLUSH_INTERVAL', '10'))
+
+_increment = (
+    update(Product.__table__)
+    .where(Product.__table__.c.id == bindparam("product_id"))
+    .values(views=Product.__table__.c.views + bindparam("delta"))
+)
+
+
+class ViewCounter(PeriodicFlusher):
+    name = "Просмотры товаров"
+
+    def __init__(self, interval: float = VIEW_FLUSH_INTERVAL):
+        super().__init__(interval)
+        self._pending: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, product_id: int) -> None:
+        with self._lock:
+            self._pending[product_id] += 1
+
+    def pending(self, product_id: int) -> int:
+        """Просмотры товара, еще не записанные в БД"""
+        with self._lock:
+            return self._pending.get(product_id, 0)
+
+    def flush(self) -> int:
+        """Записывает накопленные просмотры одной транзакцией, возвращает их число"""
+        with self._lock:
+            batch, self._pending = self._pending, Counter()
+        if not batch:
+            return 0
+        try:
+            with write_guard(), engine.begin() as conn:
+                conn.execute(_increment, [
+                    {"product_id": product_id, "delta": delta} for product_id, delta in batch.items()
+                ])
+        except Exception as e:
+            # возвращаем просмотры в буфер, запишем в следующий раз
+            with self._lock:
+                self._pending.update(batch)
+            logger.warning(f"Не удалось записать просмотры товаров: {e}")
+            return 0
+        return sum(batch.values())
+
+
+view_counter = ViewCounter()
@@ -16,6 +16,7 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 BASE_URL = os.getenv("BASE_URL", "http://localhost:5175")
 BACKEND_API = os.getenv("BACKEND_API", "http://localhost:8000")
+BOT_API_SECRET = os.getenv("BOT_API_SECRET", "")
 ADMINS = [s.strip() for s in os.getenv("ADMINS", "").split(",") if s.strip()]
 
 if not BOT_TOKEN:
@@ -126,6 +127,23 @@ async def handle_webapp_data(message: types.Message):
         await message.answer("❌ Произошла ошибка при обработке заявки")
 
 
+async def remember_receipt_file_id(receipt_sha256, file_id):
+    """Сохраняет file_id чека в backend, чтобы следующие отправки шли без загрузки файла"""
+    if not receipt_sha256 or not BOT_API_SECRET:
+        return
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.put(
+                f"{BACKEND_API}/api/balance/receipt-file/{receipt_sha256}/telegram",
+                json={"file_id": file_id},
+                headers={"X-Bot-Secret": BOT_API_SECRET}
+            ) as resp:
+                if resp.status != 200:
+                    logger.warning(f"Backend не сохранил file_id чека: {resp.status}")
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить file_id чека: {e}")
+
+
 async def handle_payment_confirmation(message: types.Message, payment_data):
     """ИСПРАВЛЕНО: обработчик пополнения с отправкой чека"""
     try:
@@ -140,6 +158,9 @@ async def handle_payment_confirmation(message: types.Message, payment_data):
 
         # НОВОЕ: Получаем чек из backend
         receipt_path = None
+        receipt_sha256 = None
+        receipt_preview_path = None  # сжатое превью (JPEG), если уже готово
+        receipt_file_id = None  # file_id в Telegram, если этот файл уже отправлялся
         try:
             async with aiohttp.ClientSession() as session:
                 # Запрашиваем данные заявки для получения пути к чеку
@@ -152,6 +173,9 @@ async def handle_payment_confirmation(message: types.Message, payment_data):
                         )
                         if current_request:
                             receipt_path = current_request.get('receipt_path')
+                            receipt_sha256 = current_request.get('receipt_sha256')
+                            receipt_file_id = current_request.get('receipt_telegram_file_id')
+                            receipt_preview_path = current_request.get('receipt_preview_path')
         except Exception as e:
             logger.warning(f"Не удалось получить данные чека: {e}")
 
@@ -201,26 +225,38 @@ async def handle_payment_confirmation(message: types.Message, payment_data):
                 admin_id_int = int(admin_id)
 
                 # НОВОЕ: Отправляем сообщение с чеком если есть
-                if receipt_path and Path(receipt_path).exists():
+                if receipt_path and (receipt_file_id or Path(receipt_path).exists()):
                     try:
+                        # Уже загруженный в Telegram файл отправляем по file_id, без повторной загрузки
+                        # Иначе загружаем превью: оно в разы меньше оригинала (HEIC тоже станет JPEG)
+                        upload_path = receipt_preview_path if receipt_preview_path and Path(receipt_preview_path).exists() else receipt_path
+                        receipt = receipt_file_id or FSInputFile(upload_path)
                         # Определяем тип файла для правильной отправки
-                        file_path = Path(receipt_path)
+                        file_path = Path(upload_path)
                         if file_path.suffix.lower() in ['.jpg', '.jpeg', '.png', '.webp']:
                             # Отправляем как фото
-                            await bot.send_photo(
+                            sent = await bot.send_photo(
                                 chat_id=admin_id_int,
-                                photo=FSInputFile(receipt_path),
+                                photo=receipt,
                                 caption=admin_message,
                                 reply_markup=kb
                             )
+                            sent_file_id = sent.photo[-1].file_id
                         else:
                             # Отправляем как документ (PDF и др.)
-                            await bot.send_document(
+                            sent = await bot.send_document(
                                 chat_id=admin_id_int,
-                                document=FSInputFile(receipt_path),
+                                document=receipt,
                                 caption=admin_message,
                                 reply_markup=kb
                             )
+                            sent_file_id = sent.document.file_id
+                        if not receipt_file_id:
+                            receipt_file_id = sent_file_id
+                            # HEIC, отправленный документом до готовности превью, не запоминаем:
+                            # в следующий раз превью уйдет фотографией
+                            if file_path.suffix.lower() not in ['.heic', '.heif']:
+                                await remember_receipt_file_id(receipt_sha256, sent_file_id)
                     except Exception as file_error:
                         logger.error(f"Ошибка отправки файла админу {admin_id}: {file_error}")
                         # Fallback: отправляем без файла
@@ -10,6 +10,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from backend.db import get_session
 from backend.models import *
+from backend import counters, search, versions  # noqa: F401 — счетчики, поисковый индекс и версии таблиц обновляются при создании товаров
 
 
 def create_test_data():